@@ -0,0 +1,116 @@
+"""Compare the cost of fetching rows and accessing their columns with
+the default, the changeling and the compact row types.
+
+PostgreSQL and MySQL are skipped if their drivers are not installed or
+the test databases (see quma/tests/util.py) are not reachable.
+"""
+
+import sys
+from functools import partial
+from timeit import Timer
+
+import quma
+from quma.tests import util
+
+loops = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+rows = 1000
+
+CREATE = """
+CREATE TABLE rowbench (
+    id INT PRIMARY KEY,
+    name VARCHAR(128) NOT NULL,
+    email VARCHAR(128) NOT NULL,
+    city VARCHAR(128) NOT NULL);
+"""
+SELECT = "SELECT id, name, email, city FROM rowbench"
+
+PROVIDERS = (
+    ("SQLite", "sqlite:///:memory:", "?", {"persist": True}),
+    ("PostgreSQL", util.PGSQL_URI, "%s", {"persist": True}),
+    ("MySQL", util.MYSQL_URI, "%s", {"persist": True, "charset": "utf8"}),
+)
+ROW_TYPES = (
+    ("default", {}),
+    ("changeling", {"changeling": True}),
+    ("compact", {"compact_rows": True}),
+)
+
+
+def by_attr(row):
+    return row.id, row.name, row.email, row.city
+
+
+def by_key(row):
+    return row["id"], row["name"], row["email"], row["city"]
+
+
+def by_index(row):
+    return row[0], row[1], row[2], row[3]
+
+
+ACCESS = (("attr", by_attr), ("key", by_key), ("index", by_index))
+
+
+def get_db(uri, placeholder, kwargs):
+    db = quma.Database(uri, **kwargs)
+    with db.cursor as cur:
+        cur.execute("DROP TABLE IF EXISTS rowbench")
+        cur.execute(CREATE)
+        cur.executemany(
+            "INSERT INTO rowbench VALUES ({})".format(
+                ", ".join([placeholder] * 4)
+            ),
+            [
+                (i, "User {}".format(i), "user{}@example.com".format(i), "C")
+                for i in range(rows)
+            ],
+        )
+        cur.commit()
+    return db
+
+
+def fetch(db):
+    with db.cursor as cur:
+        return cur.query(SELECT).all()
+
+
+def access(result, getter):
+    for row in result:
+        getter(row)
+
+
+def bench(name, uri, placeholder, kwargs):
+    print("\n{} ({} rows, {} loops)".format(name, rows, loops))
+    print("-" * 50)
+    print("{:<12}{:>10}{:>10}{:>10}{:>10}".format("", "fetch", *dict(ACCESS)))
+    for row_type, type_kwargs in ROW_TYPES:
+        try:
+            db = get_db(uri, placeholder, dict(kwargs, **type_kwargs))
+        except (ImportError, quma.ConnectionError) as e:
+            print("skipped: {}".format(e))
+            return
+        timings = [Timer(partial(fetch, db)).timeit(number=loops)]
+        result = fetch(db)
+        for _, getter in ACCESS:
+            try:
+                getter(result[0])
+            except (AttributeError, KeyError, IndexError, TypeError):
+                timings.append(None)
+                continue
+            timer = Timer(partial(access, result, getter))
+            timings.append(timer.timeit(number=loops))
+        print(
+            "{:<12}".format(row_type)
+            + "".join(
+                "{:>10}".format("-" if t is None else "{:.4f}".format(t))
+                for t in timings
+            )
+        )
+        with db.cursor as cur:
+            cur.execute("DROP TABLE rowbench")
+            cur.commit()
+        db.close()
+
+
+for provider in PROVIDERS:
+    bench(*provider)
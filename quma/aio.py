@@ -0,0 +1,293 @@
+"""An asyncio API on top of :class:`quma.Database`.
+
+The blocking DBAPI calls are run in a thread pool which is sized
+together with the connection pool, so a query never waits for a thread
+while a connection is available::
+
+    from quma.aio import AsyncDatabase
+
+    db = AsyncDatabase('sqlite:///:memory:', sqldirs, persist=True)
+
+    async with db.cursor as cur:
+        user = await cur.users.by_name(name='User 1').one()
+        async for user in cur.users.all():
+            print(user.name)
+"""
+
+import asyncio
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import (
+    partial,
+    wraps,
+)
+from itertools import islice
+
+from .database import Database
+from .namespace import CursorNamespace
+from .query import (
+    STREAM_SIZE,
+    ManyResult,
+    Query,
+)
+from .script import (
+    CursorScript,
+    Script,
+)
+
+
+def take(iterator, size):
+    return list(islice(iterator, size))
+
+
+class AsyncQuery(object):
+    """Wraps a :class:`quma.query.Query`. Its methods are coroutines."""
+
+    def __init__(self, cursor, query):
+        self.cursor = cursor
+        self.query = query
+
+    def __getattr__(self, attr):
+        value = getattr(self.query, attr)
+        if callable(value):
+            return self.cursor.wrap(value)
+        return value
+
+    def many(self):
+        return AsyncManyResult(self.cursor, self.query.many())
+
+    async def _batches(self, rows):
+        size = self.query.stream_size if self.query.stream else STREAM_SIZE
+        while True:
+            batch = await self.cursor.db.run(take, rows, size)
+            if not batch:
+                break
+            for row in batch:
+                yield row
+
+    def __aiter__(self):
+        return self._batches(iter(self.query))
+
+    def unbunch(self, size=None):
+        """The asynchronous counterpart of :meth:`Query.unbunch`."""
+        return self._batches(self.query.unbunch(size))
+
+
+class AsyncManyResult(object):
+    def __init__(self, cursor, result):
+        self.cursor = cursor
+        self.result = result
+
+    async def get(self, size=None):
+        return await self.cursor.db.run(self.result.get, size)
+
+
+class AsyncScript(object):
+    def __init__(self, cursor, script):
+        self.cursor = cursor
+        self.script = script
+
+    def __call__(self, *args, **kwargs):
+        # Creating a query does not touch the database
+        return AsyncQuery(self.cursor, self.script(*args, **kwargs))
+
+    async def many(self, rows, **kwargs):
+        return await self.cursor.db.run(self.script.many, rows, **kwargs)
+
+
+class AsyncCursorNamespace(object):
+    def __init__(self, cursor, namespace):
+        self.cursor = cursor
+        self.namespace = namespace
+
+    def __getattr__(self, attr):
+        value = getattr(self.namespace, attr)
+        if isinstance(value, CursorScript):
+            return AsyncScript(self.cursor, value)
+        if callable(value):
+            # A custom namespace method
+            return self.cursor.wrap(value)
+        return value
+
+    def __call__(self, *args, **kwargs):
+        # A root level script or custom root method
+        if isinstance(self.namespace.namespace, Script):
+            return AsyncQuery(self.cursor, self.namespace(*args, **kwargs))
+        return self.cursor.wrap(self.namespace)(*args, **kwargs)
+
+
+class AsyncCursor(object):
+    """Wraps a :class:`quma.cursor.Cursor`.
+
+    Scripts return :class:`AsyncQuery` objects and the methods of the
+    cursor and of custom namespaces are coroutines.
+    """
+
+    def __init__(self, db, cursor):
+        self.db = db
+        self.cursor = cursor
+        self.slots = None
+
+    async def _open(self, autocommit=False):
+        slots = self.db.get_slots()
+        if slots is not None:
+            await slots.acquire()
+        try:
+            await self.db.run(self.cursor.create_cursor, autocommit=autocommit)
+        except Exception:
+            if slots is not None:
+                slots.release()
+            raise
+        self.slots = slots
+        return self
+
+    async def _release(self, func, *args):
+        try:
+            await self.db.run(func, *args)
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+                self.slots = None
+
+    async def __aenter__(self):
+        return await self._open()
+
+    async def __aexit__(self, *args):
+        await self._release(self.cursor.__exit__, *args)
+
+    async def __call__(self, autocommit=False):
+        return await self._open(autocommit=autocommit)
+
+    async def put(self, force=False):
+        await self._release(self.cursor.put, force)
+
+    async def close(self):
+        await self._release(self.cursor.close)
+
+    def wrap(self, func):
+        """Return a coroutine function which runs ``func`` in the thread
+        pool."""
+
+        @wraps(func)
+        async def call(*args, **kwargs):
+            result = await self.db.run(func, *args, **kwargs)
+            if isinstance(result, Query):
+                return AsyncQuery(self, result)
+            if isinstance(result, ManyResult):
+                return AsyncManyResult(self, result)
+            return result
+
+        return call
+
+    def query(self, content, *args, **kwargs):
+        return AsyncQuery(self, self.cursor.query(content, *args, **kwargs))
+
+    def __getattr__(self, attr):
+        value = getattr(self.cursor, attr)
+        if isinstance(value, CursorNamespace):
+            return AsyncCursorNamespace(self, value)
+        if callable(value):
+            return self.wrap(value)
+        return value
+
+
+class AsyncDatabaseCallWrapper(object):
+    def __init__(self, db, wrapper):
+        self.db = db
+        self.wrapper = wrapper
+
+    @property
+    def cursor(self):
+        return AsyncCursor(self.db, self.wrapper.cursor)
+
+
+class AsyncDatabase(object):
+    """The asynchronous counterpart of :class:`quma.Database`. Takes the
+    same arguments and additionally:
+
+    :param max_workers: The number of threads which execute the blocking
+        calls. Defaults to the maximum number of connections, i. e.
+        ``size`` + ``overflow`` of a pool and 1 for a persistent
+        connection.
+    """
+
+    def __init__(self, dburi, *args, **kwargs):
+        workers = kwargs.pop("max_workers", None)
+        if dburi.startswith("sqlite"):
+            # The connections are used by the threads of the executor.
+            # quma never uses a connection from two threads at once.
+            kwargs.setdefault("check_same_thread", False)
+        self.db = Database(dburi, *args, **kwargs)
+        if workers is None:
+            workers = self.db.conn.max_connections
+        self.max_workers = workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="quma"
+        )
+        # A semaphore per event loop, see get_slots
+        self._slots = weakref.WeakKeyDictionary()
+
+    def __call__(self, carrier=None, autocommit=False):
+        return AsyncDatabaseCallWrapper(
+            self, self.db(carrier=carrier, autocommit=autocommit)
+        )
+
+    def get_slots(self):
+        """Return the semaphore which limits the number of open cursors
+        to the number of threads or ``None`` if it is unlimited.
+
+        A cursor waiting for a connection of an exhausted pool blocks
+        a thread. Without the limit all threads could be blocked while
+        the cursors holding the connections wait for a thread.
+        """
+        if self.max_workers is None:
+            return None
+        loop = asyncio.get_running_loop()
+        try:
+            return self._slots[loop]
+        except KeyError:
+            slots = self._slots[loop] = asyncio.Semaphore(self.max_workers)
+            return slots
+
+    async def run(self, func, *args, **kwargs):
+        """Run ``func`` in the thread pool and return its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, partial(func, *args, **kwargs)
+        )
+
+    @property
+    def cursor(self):
+        """Return a cursor. Use it as asynchronous context manager or
+        await its call to open the connection."""
+        return AsyncCursor(self, self.db.cursor)
+
+    async def run_with_connection(self, func, *args, **kwargs):
+        """Run ``func``, which checks out a connection, in the thread
+        pool while holding a slot, see :meth:`get_slots`."""
+        slots = self.get_slots()
+        if slots is None:
+            return await self.run(func, *args, **kwargs)
+        async with slots:
+            return await self.run(func, *args, **kwargs)
+
+    async def execute(self, query, **kwargs):
+        return await self.run_with_connection(self.db.execute, query, **kwargs)
+
+    async def executemany(self, query, rows, **kwargs):
+        return await self.run_with_connection(
+            self.db.executemany, query, rows, **kwargs
+        )
+
+    async def copy(self, table, rows, columns=None):
+        return await self.run_with_connection(
+            self.db.copy, table, rows, columns=columns
+        )
+
+    async def release(self, carrier):
+        await self.run(self.db.release, carrier)
+
+    async def close(self):
+        """Close all connections and shut down the thread pool."""
+        await self.run(self.db.close)
+        self.executor.shutdown(wait=False)
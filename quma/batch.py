@@ -0,0 +1,136 @@
+"""Rewrite single row ``INSERT`` statements to multi-row statements.
+
+For DBAPI drivers whose ``executemany`` executes the statement once per
+row, ``INSERT INTO t (a, b) VALUES (?, ?)`` executed for 100 rows is
+rewritten to a single ``INSERT`` with 100 value tuples. Supports the
+``qmark`` and ``named`` parameter styles.
+"""
+
+import re
+from functools import lru_cache
+
+from .script import chunked
+
+INSERT_RE = re.compile(r"^\s*(?:insert|replace)\b", re.I)
+VALUES_RE = re.compile(r"\bvalues\s*\(", re.I)
+# String literals are matched to skip them. The third group matches
+# placeholder styles which are not supported.
+PLACEHOLDER_RE = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\""
+    r"|(\?)(?!\d)|(?<!:):([A-Za-z_]\w*)|(\?\d|[$@][A-Za-z_])"
+)
+# The maximum number of rows per statement
+BATCH_ROWS = 500
+
+
+def tuple_end(content, start):
+    """Return the index after the parenthesis matching the one at
+    ``start`` or ``None``."""
+    depth, quote = 0, None
+    for i in range(start, len(content)):
+        char = content[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return None
+
+
+def placeholders(content):
+    """Return the number of qmark placeholders and the names of the named
+    placeholders in ``content`` or ``None`` if another style is used."""
+    qmarks, names = 0, []
+    for match in PLACEHOLDER_RE.finditer(content):
+        if match.group(1):
+            qmarks += 1
+        elif match.group(2):
+            names.append(match.group(2))
+        elif match.group(3):
+            return None
+    return qmarks, names
+
+
+@lru_cache(maxsize=256)
+def split_insert(content):
+    """Split the single row ``INSERT`` statement ``content`` into the part
+    before the value tuple, the tuple and the rest.
+
+    Returns ``None`` if ``content`` is something else, e. g. an ``INSERT``
+    with a ``SELECT`` or multiple value tuples or with mixed or without
+    placeholders. Otherwise returns a tuple ``(prefix, values, suffix,
+    variables, names)``. ``values`` uses qmark placeholders, ``variables``
+    is their number and ``names`` the names of the original placeholders
+    in order or ``None`` for the ``qmark`` style.
+    """
+    content = content.strip().rstrip(";").rstrip()
+    if not INSERT_RE.match(content) or ";" in content:
+        return None
+    match = VALUES_RE.search(content)
+    if match is None:
+        return None
+    start = match.end() - 1
+    end = tuple_end(content, start)
+    if end is None or content[end:].lstrip().startswith(","):
+        return None
+    # Parameters outside of the value tuple, e. g. of an upsert
+    if placeholders(content[:start] + content[end:]) != (0, []):
+        return None
+    found = placeholders(content[start:end])
+    if found is None or bool(found[0]) == bool(found[1]):
+        return None
+    qmarks, names = found
+    # Named placeholders are replaced with qmarks as SQLite looks up
+    # names linearly, which is slow for statements with many names.
+    values = PLACEHOLDER_RE.sub(
+        lambda m: "?" if m.group(1) or m.group(2) else m.group(0),
+        content[start:end],
+    )
+    return (
+        content[:start],
+        values,
+        content[end:],
+        qmarks or len(names),
+        tuple(names) or None,
+    )
+
+
+@lru_cache(maxsize=256)
+def multi_insert(content, rows):
+    """Return ``content`` rewritten to insert ``rows`` rows at once
+    using qmark placeholders."""
+    prefix, values, suffix = split_insert(content)[:3]
+    return "{}{}{}".format(prefix, ",\n".join([values] * rows), suffix)
+
+
+def executemany(cursor, content, params, max_variables):
+    """Execute ``content`` for each item of ``params`` with multi-row
+    statements if possible and fall back to ``cursor.executemany``.
+
+    :param max_variables: The maximum number of parameters per statement.
+    """
+    statement = split_insert(content)
+    if statement is None:
+        cursor.executemany(content, params)
+        return
+    variables, names = statement[3:]
+    size = max(1, min(BATCH_ROWS, max_variables // variables))
+    for chunk in chunked(params, size):
+        if len(chunk) == 1:
+            cursor.execute(content, chunk[0])
+        elif names is None:
+            cursor.execute(
+                multi_insert(content, len(chunk)),
+                [value for row in chunk for value in row],
+            )
+        else:
+            cursor.execute(
+                multi_insert(content, len(chunk)),
+                [row[name] for row in chunk for name in names],
+            )
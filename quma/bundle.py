@@ -0,0 +1,191 @@
+"""Pack sqldirs into a single bundle file.
+
+A bundle contains the scripts, the templates and the compiled namespace
+modules of one or more sqldirs. :class:`quma.Database` loads it with a
+single read instead of walking the directories::
+
+    from quma import bundle
+
+    bundle.build(['/path/to/sql', '/path/to/more/sql'], 'app.qbundle')
+    db = Database('sqlite:///:memory:', bundle='app.qbundle')
+
+Bundles are written with :mod:`marshal` and can only be loaded by the
+Python version which has built them.
+"""
+
+import argparse
+import importlib.util
+import marshal
+import os
+import re
+import types
+from pathlib import (
+    Path,
+    PurePosixPath,
+)
+
+from .namespace import DirIndex
+
+try:
+    from mako.lookup import TemplateLookup
+    from mako.template import Template
+except ImportError:
+    TemplateLookup = None
+
+VERSION = 1
+MAGIC = b"QUMA" + bytes([VERSION]) + importlib.util.MAGIC_NUMBER
+
+
+def pack_dir(index, root=True):
+    init = None
+    if index.has_init:
+        filename = str(index.path / "__init__.py")
+        with open(filename, "r") as f:
+            init = compile(f.read(), filename, "exec", dont_inherit=True)
+    return {
+        "path": str(index.path),
+        "init": init,
+        "scripts": {
+            stem: (sqlfile.name, index.read(sqlfile))
+            for stem, sqlfile in index.scripts.items()
+        },
+        "dirs": [
+            pack_dir(index.subindex(path), root=False) for path in index.dirs
+        ]
+        if root
+        else [],
+    }
+
+
+def pack_templates(sqldir, tmpl_ext, templates):
+    sqldir = Path(sqldir)
+    for dirpath, dirnames, filenames in os.walk(sqldir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith("." + tmpl_ext):
+                continue
+            path = Path(dirpath) / filename
+            uri = str(PurePosixPath(*path.relative_to(sqldir).parts))
+            # Like mako's TemplateLookup the first sqldir wins
+            if uri not in templates:
+                with open(str(path), "r") as f:
+                    templates[uri] = f.read()
+
+
+def build(sqldirs, target, file_ext="sql", tmpl_ext="msql"):
+    """Pack ``sqldirs`` into the bundle file ``target``.
+
+    :param sqldirs: One or more filesystem paths pointing to the sql
+        scripts, the same as passed to :class:`quma.Database`.
+    :param target: The path of the bundle file.
+    """
+    if isinstance(sqldirs, (str, os.PathLike)):
+        sqldirs = [sqldirs]
+    templates = {}
+    data = {
+        "file_ext": file_ext,
+        "tmpl_ext": tmpl_ext,
+        "sqldirs": [],
+        "templates": templates,
+    }
+    for sqldir in sqldirs:
+        index = DirIndex(Path(sqldir), file_ext, tmpl_ext)
+        data["sqldirs"].append(pack_dir(index))
+        pack_templates(sqldir, tmpl_ext, templates)
+    with open(str(target), "wb") as f:
+        f.write(MAGIC)
+        marshal.dump(data, f)
+
+
+def load(path):
+    """Read the bundle file at ``path`` and return its content."""
+    with open(str(path), "rb") as f:
+        content = f.read()
+    if not content.startswith(MAGIC):
+        raise ValueError(
+            "The bundle {} was built with another version of quma or "
+            "Python".format(path)
+        )
+    return marshal.loads(content[len(MAGIC) :])
+
+
+class BundleIndex(object):
+    """The counterpart of :class:`quma.namespace.DirIndex` for a packed
+    directory. Scripts are read from memory."""
+
+    def __init__(self, data):
+        self.data = data
+        self.path = Path(data["path"])
+        self.scripts = {}
+        self.contents = {}
+        for stem, (filename, content) in data["scripts"].items():
+            self.scripts[stem] = self.path / filename
+            self.contents[self.path / filename] = content
+        self.children = {Path(child["path"]): child for child in data["dirs"]}
+        self.dirs = list(self.children)
+        self.has_init = data["init"] is not None
+
+    def subindex(self, path):
+        return BundleIndex(self.children[path])
+
+    def read(self, sqlfile):
+        try:
+            return self.contents[sqlfile]
+        except KeyError as e:
+            raise FileNotFoundError(str(sqlfile)) from e
+
+    def load_module(self, name):
+        module = types.ModuleType(name)
+        module.__file__ = str(self.path / "__init__.py")
+        exec(self.data["init"], module.__dict__)
+        return module
+
+
+class BundleLookup(TemplateLookup or object):
+    """A mako template lookup which compiles the packed templates on
+    first access."""
+
+    def __init__(self, templates, **kwargs):
+        super().__init__(**kwargs)
+        self.templates = templates
+
+    def get_template(self, uri):
+        uri = re.sub(r"^\/+", "", uri)
+        try:
+            return self._collection[uri]
+        except KeyError:
+            pass
+        try:
+            source = self.templates[uri]
+        except KeyError:
+            # Let mako raise its lookup exception
+            return super().get_template(uri)
+        self._collection[uri] = Template(
+            source, lookup=self, uri=uri, **self.template_args
+        )
+        return self._collection[uri]
+
+
+def get_lookup(data):
+    """Return a template lookup for the templates of the bundle ``data``
+    or ``None`` if mako is not installed."""
+    if TemplateLookup is None:
+        return None
+    return BundleLookup(data["templates"], filesystem_checks=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m quma.bundle",
+        description="Pack sqldirs into a bundle file.",
+    )
+    parser.add_argument("target", help="the bundle file")
+    parser.add_argument("sqldirs", nargs="+", help="the sql directories")
+    parser.add_argument("--file-ext", default="sql")
+    parser.add_argument("--tmpl-ext", default="msql")
+    args = parser.parse_args(argv)
+    build(args.sqldirs, args.target, args.file_ext, args.tmpl_ext)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,93 @@
+import re
+import time
+from collections import OrderedDict
+
 from . import exc
 
+# A single SELECT statement. Leading comments are allowed.
+SELECT_RE = re.compile(
+    r"^\s*(?:--[^\n]*\n\s*|/\*.*?\*/\s*)*select\b", re.I | re.S
+)
+# Statements which can't be wrapped into a subquery: multiple
+# statements, locking clauses and SELECT ... INTO.
+UNSAFE_RE = re.compile(
+    r";|\binto\b|\bfor\s+(?:update|share|no\s+key|key)\b", re.I
+)
+
+
+def plain_select(content):
+    """Return ``content`` without trailing semicolons if it is a single
+    plain SELECT statement, otherwise ``None``."""
+    content = content.strip().rstrip(";").rstrip()
+    if SELECT_RE.match(content) and not UNSAFE_RE.search(content):
+        return content
+    return None
+
+
+class PreparedStatements(object):
+    """The registry of the server side prepared statements of a single
+    connection.
+
+    Counts the executions of statements and tells when a statement
+    should be prepared. Holds at most ``size`` statements and evicts
+    the least recently used one if it is full.
+
+    :param threshold: The number of executions after which a statement
+        is prepared.
+    :param size: The maximum number of prepared statements.
+    """
+
+    def __init__(self, threshold, size):
+        self.threshold = threshold
+        self.size = size
+        self.counts = OrderedDict()
+        self.names = OrderedDict()
+        # Statements the DBMS refused to prepare
+        self.rejected = set()
+        self.ids = 0
+
+    def lookup(self, content):
+        """Return the name of the prepared statement ``content`` or
+        ``None`` if it is not prepared yet."""
+        name = self.names.get(content)
+        if name is not None:
+            self.names.move_to_end(content)
+        return name
+
+    def hit(self, content):
+        """Count an execution of ``content``. Return ``True`` if it
+        should be prepared now."""
+        if content in self.rejected:
+            return False
+        hits = self.counts.pop(content, 0) + 1
+        if hits >= self.threshold:
+            return True
+        self.counts[content] = hits
+        # Keep the counts of rarely executed statements bounded
+        if len(self.counts) > self.size * 4:
+            self.counts.popitem(last=False)
+        return False
+
+    def new_name(self):
+        self.ids += 1
+        return "quma_{}".format(self.ids)
+
+    def add(self, content, name):
+        self.names[content] = name
+
+    def reject(self, content):
+        if len(self.rejected) >= self.size * 4:
+            self.rejected.clear()
+        self.rejected.add(content)
+
+    def evict(self):
+        """Remove the least recently used statements until there is room
+        for a new one. Return the names of the removed statements."""
+        evicted = []
+        while len(self.names) >= self.size:
+            evicted.append(self.names.popitem(last=False)[1])
+        return evicted
+
 
 class Connection(object):
     """Abstract base class for DBMS specific connection objects"""
@@ -15,8 +103,15 @@ class Connection(object):
         self.url = url
         self.factory = None
         self.changeling = kwargs.pop("changeling", False)
+        self.compact_rows = kwargs.pop("compact_rows", False)
         self.persist = kwargs.pop("persist", False)
         self.pessimistic = kwargs.pop("pessimistic", False)
+        # Pessimistic checks only run on connections idle at least
+        # this many seconds.
+        self.check_interval = kwargs.pop("check_interval", 0)
+        self._idle_since = 0
+        self.prepare = kwargs.pop("prepare", None)
+        self.prepare_size = kwargs.pop("prepare_size", 100)
         self.has_rowcount = True
         self.dbapi_kwargs = kwargs
 
@@ -24,12 +119,86 @@ class Connection(object):
         if self.persist:
             self.conn = self.create_conn(**self.dbapi_kwargs)
 
+    @property
+    def max_connections(self):
+        """The number of connections which can be used at once or
+        ``None`` if unlimited."""
+        return 1 if self.persist else None
+
+    @property
+    def thread_bound(self):
+        """If connections can only be used by the thread which created
+        them."""
+        return False
+
     def cursor(self, conn):
         return conn.cursor()
 
     def get_cursor_attr(self, cursor, key):
         return getattr(cursor, key)
 
+    def execute(self, conn, cursor, content, params):
+        """Execute the statement ``content`` of a script. Providers
+        which support it execute frequently used statements as server
+        side prepared statements if ``prepare`` is set."""
+        cursor.execute(content, params)
+
+    def prepared_statements(self, conn):
+        """Return the registry of the prepared statements of ``conn``.
+
+        It is stored on the DBAPI connection, so it lives as long as
+        the session on the server and survives checkouts from a pool.
+        """
+        try:
+            return conn.quma_statements
+        except AttributeError:
+            statements = PreparedStatements(self.prepare, self.prepare_size)
+            conn.quma_statements = statements
+            return statements
+
+    def executemany(self, cursor, content, params):
+        """Execute ``content`` once for each item of ``params``."""
+        cursor.executemany(content, params)
+
+    def copy(self, cursor, table, rows, columns=None):
+        raise exc.APIError("COPY is only supported by PostgreSQL")
+
+    def limit_query(self, content, limit):
+        """Return ``content`` rewritten to return at most ``limit`` rows
+        in the original order or ``None`` if it can't be rewritten."""
+        content = plain_select(content)
+        if content is None:
+            return None
+        # Newlines, as content may end with a line comment
+        return "SELECT * FROM (\n{}\n) AS quma_limit LIMIT {:d}".format(
+            content, limit
+        )
+
+    def count_query(self, content):
+        """Return ``content`` rewritten to count its rows or ``None``
+        if it can't be rewritten."""
+        content = plain_select(content)
+        if content is None:
+            return None
+        return "SELECT count(*) FROM (\n{}\n) AS quma_count".format(content)
+
+    def exists_query(self, content):
+        """Return ``content`` rewritten to a single row, single column
+        query telling if it has any rows or ``None`` if it can't be
+        rewritten."""
+        content = plain_select(content)
+        if content is None:
+            return None
+        return "SELECT EXISTS (\n{}\n) AS quma_exists".format(content)
+
+    def stream_cursor(self, conn, size):
+        """Return a server side cursor of ``conn`` which fetches ``size``
+        rows at once or ``None`` if not supported."""
+        return None
+
+    def close_stream_cursor(self, cursor):
+        cursor.close()
+
     def create_conn(self):
         raise NotImplementedError
 
@@ -39,23 +208,59 @@ class Connection(object):
     def disable_autocommit(self, conn):
         raise NotImplementedError
 
+    def autocommit_enabled(self, conn):
+        raise NotImplementedError
+
+    def in_transaction(self, conn):
+        """Return if a transaction of ``conn`` may be open. Providers
+        answer without a round trip if the driver knows the status."""
+        return True
+
+    def switch_autocommit(self, conn, autocommit):
+        """Enable or disable autocommit if ``conn`` is in the other
+        mode."""
+        if self.autocommit_enabled(conn) != autocommit:
+            if autocommit:
+                self.enable_autocommit_if(True, conn)
+            else:
+                self.disable_autocommit(conn)
+        return conn
+
+    def reset(self, conn, autocommit=False):
+        """Roll back a possibly open transaction of ``conn`` and set its
+        autocommit mode before it is reused."""
+        if self.in_transaction(conn):
+            conn.rollback()
+        return self.switch_autocommit(conn, autocommit)
+
     def get(self, autocommit=False):
         if self.persist:
-            if self.pessimistic:
-                try:
-                    self.check()
-                except exc.OperationalError:
-                    self.conn = self.create_conn(**self.dbapi_kwargs)
-            return self.enable_autocommit_if(autocommit, self.conn)
+            if self.pessimistic and not self._alive():
+                self.conn = self.create_conn(**self.dbapi_kwargs)
+            return self.switch_autocommit(self.conn, autocommit)
         return self.enable_autocommit_if(
             autocommit, self.create_conn(**self.dbapi_kwargs)
         )
 
+    def _alive(self):
+        if not self.probe(self.conn):
+            return False
+        if time.monotonic() - self._idle_since < self.check_interval:
+            return True
+        try:
+            self.check()
+        except exc.OperationalError:
+            return False
+        return True
+
     def put(self, conn):
-        conn.rollback()
-        self.disable_autocommit(conn)
         if not self.persist:
+            self.reset(conn)
             conn.close()
+        else:
+            # Keep the autocommit mode, see get
+            self.reset(conn, self.autocommit_enabled(conn))
+            self._idle_since = time.monotonic()
 
     def close(self, conn=None):
         if conn:
@@ -70,6 +275,12 @@ class Connection(object):
             self.conn.close()
             del self.conn
 
+    def probe(self, conn):
+        """Return ``False`` if the driver knows that ``conn`` is broken
+        without asking the server. Doesn't detect lost connections the
+        driver hasn't noticed yet, see :meth:`check`."""
+        return True
+
     def _check(self, conn):
         raise NotImplementedError
 
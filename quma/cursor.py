@@ -22,6 +22,33 @@ class RawCursorWrapper(object):
         return self.conn.get_cursor_attr(self.cursor, key)
 
 
+class StreamCursor(object):
+    """A server side cursor on the connection of ``cursor`` which is used
+    to stream the result of a single query."""
+
+    def __init__(self, cursor, raw_cursor):
+        self.cursor = cursor
+        self.carrier = cursor.carrier
+        self.raw_cursor = RawCursorWrapper(cursor.conn, raw_cursor)
+
+    def __getattr__(self, attr):
+        return getattr(self.raw_cursor, attr)
+
+    def mogrify(self, content, params):
+        return self.cursor.conn.mogrify(self.raw_cursor, content, params)
+
+    def execute_script(self, content, params):
+        # Prepared statements can't be used with server side cursors
+        self.raw_cursor.execute(content, params)
+
+    def close(self):
+        try:
+            self.cursor._streams.remove(self)
+        except ValueError:
+            return
+        self.cursor.conn.close_stream_cursor(self.raw_cursor.cursor)
+
+
 class Cursor(object):
     def __init__(
         self, db, namespaces, contextcommit, carrier=None, autocommit=False
@@ -34,6 +61,10 @@ class Cursor(object):
         self.raw_conn = None
         self.raw_cursor = None
         self.contextcommit = contextcommit
+        # Bound namespaces of this cursor, see __getattr__
+        self._bound = {}
+        # Open server side cursors, see stream_cursor
+        self._streams = []
 
     def __enter__(self):
         return self.create_cursor()
@@ -77,6 +108,8 @@ class Cursor(object):
 
         If :param:`force` is set to True return is anyway
         """
+        for stream in list(self._streams):
+            stream.close()
         self.raw_cursor.close()
 
         if self.carrier and self.carrier.conn:
@@ -96,7 +129,7 @@ class Cursor(object):
     def rollback(self):
         self.raw_conn.rollback()
 
-    def query(self, content, *args, is_template=False, **kwargs):
+    def query(self, content, *args, is_template=False, stream=None, **kwargs):
         """
         Creates an ad hoc Query object based on content.
         """
@@ -106,8 +139,47 @@ class Cursor(object):
             is_template,
             self.db.sqldirs,
             self.db.prepare_params,
+            lookup=self.db.tmpl_lookup,
+        )
+        return Query(
+            script, self, args, kwargs, self.db.prepare_params, stream=stream
+        )
+
+    def execute_script(self, content, params):
+        """Execute the statement ``content`` of a script."""
+        self.conn.execute(
+            self.raw_conn, self.raw_cursor.cursor, content, params
         )
-        return Query(script, self, args, kwargs, self.db.prepare_params)
+
+    def executemany(self, content, params):
+        """Execute ``content`` once for each item of ``params``
+        using the most efficient method of the driver."""
+        self.conn.executemany(self.raw_cursor.cursor, content, params)
+
+    def copy(self, table, rows, columns=None):
+        """Bulk load ``rows`` into ``table``. Only supported by
+        PostgreSQL, where ``COPY ... FROM STDIN`` is used.
+
+        :param rows: An iterable of sequences or dicts.
+        :param columns: The names of the columns. Defaults to the keys
+            of the first row if it is a dict and all columns of the
+            table otherwise.
+        :return: The number of copied rows.
+        """
+        return self.conn.copy(
+            self.raw_cursor.cursor, table, rows, columns=columns
+        )
+
+    def stream_cursor(self, size):
+        """Return a server side cursor which fetches ``size`` rows at
+        once or ``None`` if the DBMS does not support it. It is closed
+        when the cursor is returned at the latest."""
+        raw_cursor = self.conn.stream_cursor(self.raw_conn, size)
+        if raw_cursor is None:
+            return None
+        stream = StreamCursor(self, raw_cursor)
+        self._streams.append(stream)
+        return stream
 
     def get_conn_attr(self, attr):
         return getattr(self.raw_conn, attr)
@@ -119,14 +191,28 @@ class Cursor(object):
         return self.conn.mogrify(self.raw_cursor, content, params)
 
     def __getattr__(self, attr):
+        namespaces = self.namespaces
+        try:
+            generation, bound = self._bound[attr]
+            if generation == namespaces.generation:
+                return bound
+        except KeyError:
+            pass
         try:
             return getattr(self.raw_cursor, attr)
         except AttributeError:
             pass
         try:
-            return CursorNamespace(get_namespace(self, attr), self)
+            target = get_namespace(self, attr)
         except AttributeError as e:
             raise AttributeError(
                 "Namespace, Root method, or cursor "
                 'attribute "{}" not found.'.format(attr)
             ) from e
+        bound = CursorNamespace(target, self)
+        # Only reuse the bound namespace if the target is memoized,
+        # i. e. stable until the namespaces change.
+        generation = namespaces.generation
+        if namespaces.resolved.get(attr) is target:
+            self._bound[attr] = (generation, bound)
+        return bound
@@ -1,19 +1,33 @@
-import importlib.util
 import threading
+import time
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    wait,
+)
+from functools import partial
 from importlib import import_module
 from pathlib import Path
 from urllib.parse import urlparse
 
 from . import (
+    bundle,
     exc,
     pool,
+    watch,
 )
 from .cursor import Cursor
 from .namespace import (
+    DirIndex,
     Namespace,
+    NamespaceRegistry,
     get_namespace,
 )
-from .script import Script
+from .query import Query
+from .script import (
+    CHUNK_SIZE,
+    Script,
+    chunked,
+)
 
 
 class Carrier(object):
@@ -98,15 +112,27 @@ class Database(object):
         of each connection pool checkout (see section "Connection Pool"), to
         test that the database connection is still viable. Defaults to
         ``False``.
+    :param check_interval: If ``pessimistic`` is ``True`` only test
+        connections which have been idle for at least this many seconds.
+        Connections the driver knows to be broken are always replaced.
+        Defaults to 0.
     :param contextcommit: If ``True`` and a context manager is used quma will
         automatically commit all changes when the context manager exits.
         Defaults to ``False``.
     :param prepare_params: A callback function which will be called before
         every query to prepare the params which will be passed to the query.
         Defaults to None.
+    :param bundle: The path of a bundle file built with
+        :func:`quma.bundle.build`. If given, scripts, templates and
+        namespaces are loaded from the bundle instead of ``sqldirs``.
+        Defaults to ``None``.
     :param file_ext: The file extension of sql files. Defaults to '``sql'``.
     :param tmpl_ext: The file extension of template files (see
         :doc:`Templates <templates>`). Defaults to ``'msql'``.
+    :param tmpl_module_dir: A filesystem path where the compiled modules of
+        templates are stored. If given, compiled templates are loaded
+        from this directory instead of being compiled again, e. g. after
+        a restart of the application. Defaults to ``None``.
     :param echo: Print the executed query to stdout if ``True``. Defaults to
         ``False``. *PostgreSQL* and *MySQL/MariaDB* connections will print the
         query after argument binding. This means placeholders will be
@@ -115,6 +141,40 @@ class Database(object):
     :param cache: cache the scripts in memory if ``True``,
         otherwise re-read each script when the query is executed.
         Defaults to ``False``.
+    :param reload_interval: If ``cache`` is ``False`` and an interval in
+        seconds is given, scripts are kept in memory and a file is only
+        re-read if its modification time or size has changed. Files are
+        checked at most once per interval. Defaults to ``None``.
+    :param eager: Namespace directories are discovered on initialization
+        but their ``__init__.py`` modules are executed and the namespace
+        classes instantiated when the first namespace is accessed, plain
+        directories when they are accessed. If ``True`` all namespaces
+        are loaded on initialization.
+        The time it took to load each namespace is available in the
+        dict ``import_times``. Defaults to ``False``.
+    :param watch: If ``True`` and ``cache`` is ``True`` quma watches the
+        sqldirs in a background thread and reloads changed, new or removed
+        scripts and namespace directories. Uses inotify on Linux and
+        polling otherwise. Pass ``'inotify'`` or ``'poll'`` to choose the
+        method explicitly. Defaults to ``False``.
+    :param watch_interval: The polling interval of the watcher in seconds.
+        Defaults to 1.
+    :param stream: If ``True`` iterating over a query fetches the rows in
+        batches of 1000 instead of fetching and keeping all of them.
+        Pass an ``int`` to set the batch size. Can be overridden by passing
+        ``stream`` to a script call. Defaults to ``False``.
+    :param rewrite: If ``True`` :meth:`Query.first`, :meth:`Query.one` and
+        :meth:`Query.exists` rewrite plain ``SELECT`` statements to
+        ``SELECT * FROM (...) LIMIT n`` or ``SELECT EXISTS (...)`` if the
+        DBMS supports it, so that the server stops early. Defaults to
+        ``False``.
+    :param prepare: PostgreSQL only. If an ``int`` is given, a statement of
+        a non-template script which has been executed this many times on
+        a connection is prepared on the server with ``PREPARE`` and
+        executed with ``EXECUTE`` afterwards. Defaults to ``None``.
+    :param prepare_size: The maximum number of prepared statements per
+        connection. The least recently used statement is deallocated if
+        the limit is reached. Defaults to 100.
 
     Additional connection pool parameters (see :doc:`Connection pool <pool>`):
 
@@ -127,6 +187,19 @@ class Database(object):
         to indicate no overflow limit. Defaults to 10.
     :param timeout: The number of seconds to wait before giving
         up on returning a connection. Defaults to None.
+    :param recycle: Replace connections which are older than this many
+        seconds when they are checked out. Defaults to None.
+    :param idle_timeout: Replace connections which have been idle for
+        at least this many seconds when they are checked out. Defaults
+        to None.
+    :param reap_interval: If set a background thread closes expired idle
+        connections every this many seconds and opens new ones up to
+        ``min_idle``. Defaults to None.
+    :param min_idle: The number of idle connections the background
+        thread keeps open. Defaults to 0.
+    :param listener: A :class:`quma.metrics.PoolListener` which is
+        notified of checkouts, checkins, timeouts and new and closed
+        connections. Defaults to None.
     """
 
     DoesNotExistError = exc.DoesNotExistError
@@ -143,18 +216,78 @@ class Database(object):
 
         self.file_ext = kwargs.pop("file_ext", "sql")
         self.tmpl_ext = kwargs.pop("tmpl_ext", "msql")
+        self.tmpl_module_dir = kwargs.pop("tmpl_module_dir", None)
+        self.tmpl_lookup = None
+        bundle_path = kwargs.pop("bundle", None)
         self.script_factory = kwargs.pop("script_factory", Script)
         self.prepare_params = kwargs.pop("prepare_params", None)
         self.contextcommit = kwargs.pop("contextcommit", False)
         self.echo = kwargs.pop("echo", False)
         self.cache = kwargs.pop("cache", False)
+        self.reload_interval = kwargs.pop("reload_interval", None)
+        self.stream = kwargs.pop("stream", False)
+        self.rewrite = kwargs.pop("rewrite", False)
+        eager = kwargs.pop("eager", False)
+        watch_method = kwargs.pop("watch", False)
+        watch_interval = kwargs.pop("watch_interval", 1.0)
+        if watch_method and not self.cache:
+            raise ValueError("Watching sqldirs requires cache=True")
+
+        packed = None
+        if bundle_path is not None:
+            packed = self._load_bundle(bundle_path, watch_method)
 
         # The remaining kwargs are passed to the DBAPI connect call
         self.conn = connect(dburi, **kwargs)
 
         self.heap = CarrierHeap()
-        self.namespaces = {}
+        self._roots = []
+        self._reload_lock = threading.RLock()
+        self.namespaces = NamespaceRegistry(
+            self._add_namespace, self._reload_lock
+        )
+        self.import_times = {}
+
+        if packed is None:
+            self._register_sqldirs()
+        else:
+            for sqldir in packed["sqldirs"]:
+                self._register(bundle.BundleIndex(sqldir))
+        if eager:
+            self.namespaces.load_all()
+
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        self.watcher = None
+        if watch_method:
+            self.watcher = watch.watch(
+                self,
+                interval=watch_interval,
+                method=None if watch_method is True else watch_method,
+            )
 
+    def __call__(self, carrier=None, autocommit=False):
+        return DatabaseCallWrapper(
+            self, carrier=carrier, autocommit=autocommit
+        )
+
+    def _load_bundle(self, path, watch_method):
+        if self.sqldirs:
+            raise ValueError("Pass either sqldirs or a bundle")
+        if watch_method or self.reload_interval is not None:
+            raise ValueError(
+                "Bundles can't be reloaded. Don't use them together "
+                "with watch or reload_interval"
+            )
+        packed = bundle.load(path)
+        self.sqldirs = [sqldir["path"] for sqldir in packed["sqldirs"]]
+        self.file_ext = packed["file_ext"]
+        self.tmpl_ext = packed["tmpl_ext"]
+        self.tmpl_lookup = bundle.get_lookup(packed)
+        return packed
+
+    def _register_sqldirs(self):
         try:
             # A single directory
             if issubclass(type(self.sqldirs), Path):
@@ -165,45 +298,118 @@ class Database(object):
             for sqldir in self.sqldirs:
                 self.register_namespace(sqldir)
 
-    def __call__(self, carrier=None, autocommit=False):
-        return DatabaseCallWrapper(
-            self, carrier=carrier, autocommit=autocommit
-        )
-
     def register_namespace(self, sqldir):
-        def instantiate(ns, ns_class, path):
-            if ns in self.namespaces:
-                # pass the old namespace to the new instance
-                shadow = self.namespaces[ns]
-                self.namespaces[ns] = ns_class(self, path, shadow=shadow)
+        sqldir = Path(sqldir)
+        self._register(DirIndex(sqldir, self.file_ext, self.tmpl_ext))
+
+    def _register(self, index):
+        self._roots.append(index.path)
+        self.namespaces.add("__root__", index.path, lambda: index)
+        for path in index.dirs:
+            self.namespaces.add(path.name, path, partial(index.subindex, path))
+
+    def _namespace_class(self, ns, index):
+        try:
+            module = index.load_module("quma.mapping.{}".format(ns))
+            if ns == "__root__":
+                class_name = "Root"
             else:
-                self.namespaces[ns] = ns_class(self, path)
+                # snake_case to CamelCase
+                class_name = "".join([s.title() for s in ns.split("_")])
+            return getattr(module, class_name)
+        except (AttributeError, FileNotFoundError):
+            return Namespace
+
+    def _add_namespace(self, path, ns, index=None):
+        start = time.perf_counter()
+        if index is None:
+            index = DirIndex(path, self.file_ext, self.tmpl_ext)
+        if index.has_init:
+            ns_class = self._namespace_class(ns, index)
+        else:
+            ns_class = Namespace
+        if hasattr(ns_class, "alias"):
+            self._insert_namespace(ns_class.alias, ns_class, path, index)
+        self._insert_namespace(ns, ns_class, path, index)
+        self.import_times[ns] = (
+            self.import_times.get(ns, 0) + time.perf_counter() - start
+        )
 
-        def register(path, ns):
-            try:
-                mod_path = str(path / "__init__.py")
-                mod_name = "quma.mapping.{}".format(ns)
-                spec = importlib.util.spec_from_file_location(
-                    mod_name, mod_path
-                )
-                module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(module)
-                if ns == "__root__":
-                    class_name = "Root"
+    def _root_index(self, path):
+        if path in self._roots:
+            return self._roots.index(path)
+        return self._roots.index(path.parent)
+
+    def _insert_namespace(self, ns, ns_class, path, index):
+        """Insert a new namespace instance into the shadow chain of
+        ``ns``. Namespaces from later sqldirs shadow earlier ones.
+        """
+        position = self._root_index(path)
+        prev, node = None, self.namespaces.get(ns)
+        while node is not None and self._root_index(node.sqldir) > position:
+            prev, node = node, node.shadow
+        namespace = ns_class(self, path, shadow=node, index=index)
+        if prev is None:
+            self.namespaces[ns] = namespace
+        else:
+            prev.shadow = namespace
+        self.namespaces.invalidate()
+
+    def _remove_namespace(self, path):
+        """Remove all namespace instances of the directory ``path``."""
+        self.namespaces.discard(path)
+        for ns, node in list(self.namespaces.items()):
+            prev = None
+            while node is not None:
+                if node.sqldir == path:
+                    if prev is None:
+                        self.namespaces[ns] = node.shadow
+                    else:
+                        prev.shadow = node.shadow
                 else:
-                    # snake_case to CamelCase
-                    class_name = "".join([s.title() for s in ns.split("_")])
-                ns_class = getattr(module, class_name)
-                if hasattr(ns_class, "alias"):
-                    instantiate(ns_class.alias, ns_class, path)
-                instantiate(ns, ns_class, path)
-            except (AttributeError, FileNotFoundError):
-                instantiate(ns, Namespace, path)
-
-        register(Path(sqldir), "__root__")
-        for path in Path(sqldir).iterdir():
-            if path.is_dir() and path.name != "__pycache__":
-                register(path, path.name)
+                    prev = node
+                node = node.shadow
+            if self.namespaces[ns] is None:
+                del self.namespaces[ns]
+        self.namespaces.invalidate()
+
+    def _namespace_nodes(self, path):
+        for node in self.namespaces.values():
+            while node is not None:
+                if node.sqldir == path:
+                    yield node
+                node = node.shadow
+
+    def reload(self, path):
+        """Reload the script file or namespace directory at ``path``.
+
+        Used by the watcher (see ``watch``) to incrementally update the
+        cached scripts after a file or directory in one of the sqldirs
+        has been created, modified or deleted.
+        """
+        path = Path(path)
+        if path.name == "__pycache__":
+            return
+        exts = ("." + self.file_ext, "." + self.tmpl_ext)
+        with self._reload_lock:
+            if path.parent in self._roots and (
+                path.is_dir()
+                or (not path.exists() and path.suffix.lower() not in exts)
+            ):
+                # A namespace directory
+                self._remove_namespace(path)
+                if path.is_dir():
+                    self._add_namespace(path, path.name)
+            elif path.name == "__init__.py":
+                self._remove_namespace(path.parent)
+                if path.parent in self._roots:
+                    self._add_namespace(path.parent, "__root__")
+                else:
+                    self._add_namespace(path.parent, path.parent.name)
+            elif path.suffix.lower() in exts:
+                for node in list(self._namespace_nodes(path.parent)):
+                    node._reload_script(path)
+                self.namespaces.invalidate()
 
     def execute(self, query, **kwargs):
         """Execute the statements in ``query`` and commit
@@ -221,12 +427,107 @@ class Database(object):
         except Exception as e:
             cur.rollback()
             raise e
+        finally:
+            cur.put()
         return result
 
+    def executemany(self, query, rows, chunk_size=CHUNK_SIZE):
+        """Execute ``query`` once for each item of ``rows`` in chunks of
+        ``chunk_size`` rows and commit all of them at once.
+
+        :param query: The sql query to execute.
+        :param rows: An iterable of sequences or dicts holding the
+            parameters of each execution.
+        :return: The number of executed rows.
+        """
+        count = 0
+        cur = self.cursor()
+        try:
+            for chunk in chunked(rows, chunk_size):
+                cur.executemany(query, chunk)
+                count += len(chunk)
+            cur.commit()
+        except Exception as e:
+            cur.rollback()
+            raise e
+        finally:
+            cur.put()
+        return count
+
+    def copy(self, table, rows, columns=None):
+        """Bulk load ``rows`` into ``table`` and commit. See
+        :meth:`Cursor.copy`.
+
+        :return: The number of copied rows.
+        """
+        cur = self.cursor()
+        try:
+            count = cur.copy(table, rows, columns=columns)
+            cur.commit()
+        except Exception as e:
+            cur.rollback()
+            raise e
+        finally:
+            cur.put()
+        return count
+
+    def _call_with_cursor(self, func):
+        with self.cursor as cur:
+            result = func(cur)
+            if isinstance(result, Query):
+                # Fetch the rows before the connection is returned
+                result = result.all()
+            return result
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.conn.max_connections,
+                    thread_name_prefix="quma-gather",
+                )
+            return self._executor
+
+    def gather(self, *calls):
+        """Run ``calls`` concurrently in a thread pool, each with its own
+        cursor and connection, and return their results in order.
+
+        Each call is passed the cursor as its only argument, e. g. a
+        script like ``db.users.all`` or a custom namespace method. Use
+        :func:`functools.partial` to pass further arguments. Queries
+        are fetched with :meth:`Query.all` before the connection is
+        returned. If calls fail, the exception of the first failing call
+        is raised after all calls have finished.
+
+        A persistent connection can't be shared by threads and pooled
+        connections which are bound to the thread which created them,
+        like SQLite's without ``check_same_thread=False``, can't be
+        returned to the pool by a thread. In these cases the calls are
+        run one after another.
+        """
+        if (
+            self.conn.max_connections == 1
+            or self.conn.thread_bound
+            or len(calls) < 2
+        ):
+            return [self._call_with_cursor(func) for func in calls]
+        executor = self._get_executor()
+        futures = [
+            executor.submit(self._call_with_cursor, func) for func in calls
+        ]
+        wait(futures)
+        return [future.result() for future in futures]
+
     def close(self):
         """Close (all) open connections. If you want to reconnect you
         need to create a new :class:`quma.Database` instance.
         """
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
         self.conn.close()
         self.conn = None
 
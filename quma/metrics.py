@@ -0,0 +1,168 @@
+"""Metrics of connection pools.
+
+A :class:`quma.pool.Pool` notifies its listeners of checkouts, checkins,
+timeouts, new and closed connections and liveness checks. Each pool has
+a :class:`PoolMetrics` listener which aggregates the events. Additional
+listeners, e. g. to export the events to a metrics system, subclass
+:class:`PoolListener` and are passed as ``listener`` to the pool.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+# The default upper bounds of histogram buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+
+class Histogram(object):
+    """Counts observed values in buckets. A value belongs to the first
+    bucket whose upper bound is greater than or equal to it. The last
+    bucket has no upper bound."""
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        return {
+            "buckets": [
+                (bound, self.counts[i])
+                for i, bound in enumerate(self.bounds + (float("inf"),))
+            ],
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+        }
+
+
+class PoolListener(object):
+    """The interface of pool listeners. All methods receive the pool as
+    first argument and do nothing by default. They are called by the
+    thread which uses the pool, so they should return quickly."""
+
+    def connect(self, pool, conn):
+        """A new connection has been opened."""
+
+    def close(self, pool, conn):
+        """A connection has been closed by the pool."""
+
+    def checkout(self, pool, conn, wait):
+        """A connection has been checked out after ``wait`` seconds."""
+
+    def checkin(self, pool, conn, hold):
+        """A connection checked out ``hold`` seconds ago has been
+        returned."""
+
+    def timeout(self, pool, wait):
+        """No connection was available within ``wait`` seconds."""
+
+    def check(self, pool, conn, failed, roundtrip):
+        """An idle connection has been tested before it was checked out.
+        ``roundtrip`` is ``False`` if the driver already knew its state.
+        """
+
+    def mode_switch(self, pool, conn):
+        """The autocommit mode of an idle connection has been switched
+        as no connection in the requested mode was idle."""
+
+
+class PoolMetrics(PoolListener):
+    """Aggregates the events of a pool. See :meth:`snapshot`."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.since = time.monotonic()
+            self.checkouts = 0
+            self.checkins = 0
+            self.timeouts = 0
+            self.connects = 0
+            self.closes = 0
+            # The number of liveness checks with a round trip to the
+            # server and of the connections which were found broken.
+            self.checks = 0
+            self.failed_checks = 0
+            self.mode_switches = 0
+            self.max_checkedout = 0
+            self.max_overflow = None
+            self.wait_time = Histogram(self.buckets)
+            self.hold_time = Histogram(self.buckets)
+
+    def _saturation(self, pool):
+        self.max_checkedout = max(self.max_checkedout, pool.checkedout)
+        if self.max_overflow is None or pool.overflow > self.max_overflow:
+            self.max_overflow = pool.overflow
+
+    def connect(self, pool, conn):
+        with self._lock:
+            self.connects += 1
+            self._saturation(pool)
+
+    def close(self, pool, conn):
+        with self._lock:
+            self.closes += 1
+
+    def checkout(self, pool, conn, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_time.observe(wait)
+            self._saturation(pool)
+
+    def checkin(self, pool, conn, hold):
+        with self._lock:
+            self.checkins += 1
+            self.hold_time.observe(hold)
+
+    def timeout(self, pool, wait):
+        with self._lock:
+            self.timeouts += 1
+            self.wait_time.observe(wait)
+
+    def check(self, pool, conn, failed, roundtrip):
+        with self._lock:
+            if roundtrip:
+                self.checks += 1
+            if failed:
+                self.failed_checks += 1
+
+    def mode_switch(self, pool, conn):
+        with self._lock:
+            self.mode_switches += 1
+
+    def snapshot(self):
+        """Return the metrics since the creation or the last
+        :meth:`reset` as ``dict``."""
+        with self._lock:
+            elapsed = time.monotonic() - self.since
+            return {
+                "elapsed": elapsed,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "closes": self.closes,
+                "connects_per_second": self.connects / elapsed,
+                "closes_per_second": self.closes / elapsed,
+                "checks": self.checks,
+                "failed_checks": self.failed_checks,
+                "mode_switches": self.mode_switches,
+                "max_checkedout": self.max_checkedout,
+                "max_overflow": self.max_overflow,
+                "wait_time": self.wait_time.snapshot(),
+                "hold_time": self.hold_time.snapshot(),
+            }
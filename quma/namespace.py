@@ -1,6 +1,8 @@
+import importlib.util
+import os
+import time
 import types
 from functools import partial
-from itertools import chain
 from pathlib import Path
 
 from .script import (
@@ -9,54 +11,348 @@ from .script import (
 )
 
 
+def same(value):
+    return value
+
+
 def get_namespace(self, attr):
-    if attr in self.namespaces:
-        return self.namespaces[attr]
+    """Return the namespace or root member ``attr``.
+
+    Resolved names are memoized in the registry as long as the result
+    is stable, i. e. for namespaces and for root members in cache mode.
+    """
+    namespaces = self.namespaces
+    try:
+        return namespaces.resolved[attr]
+    except KeyError:
+        pass
+    generation = namespaces.generation
+    target, stable = resolve_namespace(namespaces, attr)
+    # Do not memoize a result which was resolved while the namespaces
+    # were changed by another thread.
+    if stable and generation == namespaces.generation:
+        namespaces.resolved[attr] = target
+    return target
+
 
-    root = self.namespaces["__root__"]
+def resolve_namespace(namespaces, attr):
+    namespace = namespaces.lookup(attr)
+    if namespace is not None:
+        return namespace, True
+
+    root = namespaces["__root__"]
     while root:
         try:
-            return getattr(root, attr)
+            return getattr(root, attr), root.cache
         except AttributeError:
             root = root.shadow
+
+    # attr may be the alias of a namespace which is not loaded yet
+    if namespaces.load_all():
+        return resolve_namespace(namespaces, attr)
     raise AttributeError
 
 
+class NamespaceRegistry(dict):
+    """Maps the names of namespaces to the heads of their shadow chains.
+
+    Namespace directories are registered as pending on initialization and
+    only loaded, i. e. their ``__init__.py`` is executed and the namespace
+    class instantiated, when they are accessed the first time. Aliases
+    are unknown until the namespace is loaded. As an alias may shadow
+    any other namespace, all directories with a ``__init__.py`` are
+    loaded before the first chain is returned, only plain directories
+    stay pending. If a name is not found all pending namespaces are
+    loaded.
+
+    ``resolved`` memoizes the results of :func:`get_namespace`. It must be
+    reset by calling :meth:`invalidate` whenever a shadow chain changes.
+
+    :param loader: Called with ``path``, ``ns`` and ``index`` to load a
+        pending namespace.
+    """
+
+    def __init__(self, loader, lock):
+        super().__init__()
+        self.loader = loader
+        self.lock = lock
+        self._pending = {}
+        # If the pending directories with a module have been loaded
+        self._modules_loaded = False
+        self.resolved = {}
+        self.generation = 0
+
+    def invalidate(self):
+        """Forget all memoized resolutions."""
+        self.generation += 1
+        self.resolved = {}
+
+    def add(self, ns, path, get_index):
+        """Register the namespace directory ``path`` as pending."""
+        self._pending.setdefault(ns, []).append((path, get_index))
+        self._modules_loaded = False
+
+    def discard(self, path):
+        """Forget the pending registrations of the directory ``path``."""
+        with self.lock:
+            for ns, entries in list(self._pending.items()):
+                entries = [entry for entry in entries if entry[0] != path]
+                if entries:
+                    self._pending[ns] = entries
+                else:
+                    del self._pending[ns]
+
+    def load(self, ns):
+        with self.lock:
+            for path, get_index in self._pending.pop(ns, ()):
+                self.loader(path, ns, get_index())
+
+    def load_modules(self):
+        """Load the pending namespaces which have a ``__init__.py`` in
+        any of their directories. Only these can declare aliases."""
+        with self.lock:
+            if self._modules_loaded:
+                return
+            self._modules_loaded = True
+            for ns, entries in list(self._pending.items()):
+                # Use the index, which also knows the modules of bundles,
+                # and keep it for the later load.
+                indexes = [(path, get_index()) for path, get_index in entries]
+                self._pending[ns] = [
+                    (path, partial(same, index)) for path, index in indexes
+                ]
+                if any(index.has_init for _, index in indexes):
+                    self.load(ns)
+
+    def load_all(self):
+        """Load all pending namespaces. Return ``False`` if there were
+        none."""
+        with self.lock:
+            if not self._pending:
+                return False
+            while self._pending:
+                self.load(next(iter(self._pending)))
+            return True
+
+    def lookup(self, ns):
+        """Return the namespace ``ns`` if it is loaded or pending and
+        ``None`` otherwise. Does not load other pending namespaces."""
+        # load() publishes the shadow chain one sqldir at a time. Reading
+        # under the lock waits for chains which are still being built.
+        with self.lock:
+            self.load_modules()
+            if ns in self._pending:
+                self.load(ns)
+            return dict.get(self, ns)
+
+    def __getitem__(self, ns):
+        with self.lock:
+            return super().__getitem__(ns)
+
+    def __missing__(self, ns):
+        self.load_modules()
+        if dict.__contains__(self, ns):
+            return dict.__getitem__(self, ns)
+        if ns in self._pending:
+            self.load(ns)
+        elif not self.load_all():
+            raise KeyError(ns)
+        return dict.__getitem__(self, ns)
+
+    def __contains__(self, ns):
+        with self.lock:
+            if dict.__contains__(self, ns) or ns in self._pending:
+                return True
+            return self.load_all() and dict.__contains__(self, ns)
+
+
+class DirIndex(object):
+    """The scripts and subdirectories of a sqldir or namespace directory,
+    collected with a single scan of the directory.
+
+    ``scripts`` maps the names of the scripts to their files. If both a
+    sql file and a template with the same name exist, the sql file wins.
+    """
+
+    __slots__ = (
+        "path",
+        "file_ext",
+        "tmpl_ext",
+        "scripts",
+        "dirs",
+        "has_init",
+        "scanned",
+    )
+
+    def __init__(self, path, file_ext, tmpl_ext):
+        self.path = path
+        self.file_ext = "." + file_ext
+        self.tmpl_ext = "." + tmpl_ext
+        self.scripts = {}
+        self.dirs = []
+        self.has_init = False
+        self.scanned = time.monotonic()
+
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if entry.name != "__pycache__":
+                        self.dirs.append(path / entry.name)
+                    continue
+                if entry.name == "__init__.py":
+                    self.has_init = True
+                    continue
+                stem, ext = os.path.splitext(entry.name)
+                if ext == self.file_ext:
+                    self.scripts[stem] = path / entry.name
+                elif ext == self.tmpl_ext:
+                    self.scripts.setdefault(stem, path / entry.name)
+
+    def update(self, stem):
+        """Update the entry of the script ``stem`` after a change."""
+        for ext in (self.file_ext, self.tmpl_ext):
+            sqlfile = self.path / (stem + ext)
+            if sqlfile.is_file():
+                self.scripts[stem] = sqlfile
+                return
+        self.scripts.pop(stem, None)
+
+    def subindex(self, path):
+        """Return the index of the subdirectory ``path``."""
+        return DirIndex(path, self.file_ext[1:], self.tmpl_ext[1:])
+
+    def read(self, sqlfile):
+        with open(str(sqlfile), "r") as f:
+            return f.read()
+
+    def load_module(self, name):
+        """Execute the ``__init__.py`` of the directory as module ``name``."""
+        spec = importlib.util.spec_from_file_location(
+            name, str(self.path / "__init__.py")
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+
+class ScriptFile(object):
+    """A script read from ``path`` and the state of the file at the time
+    it was read. ``script`` and ``path`` are ``None`` if no file exists.
+    """
+
+    __slots__ = ("script", "path", "stat", "checked")
+
+    def __init__(self, script, path, stat, checked):
+        self.script = script
+        self.path = path
+        self.stat = stat
+        self.checked = checked
+
+
+def file_stat(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
 class Namespace(object):
-    def __init__(self, db, sqldir, shadow=None):
+    def __init__(self, db, sqldir, shadow=None, index=None):
         self.db = db
         self.sqldir = sqldir
         self.cache = db.cache
+        self.reload_interval = db.reload_interval
         self.echo = db.echo
         self.shadow = shadow
         self._scripts = {}
+        self._files = {}
+        if index is None:
+            index = DirIndex(sqldir, db.file_ext, db.tmpl_ext)
+        self._index = index
         if db.cache:
-            self._collect_scripts(sqldir)
+            self._collect_scripts()
+
+    def _collect_scripts(self):
+        for sqlfile in self._index.scripts.values():
+            attr = self._script_attr(sqlfile)
+            self._scripts[attr] = self._load_script(sqlfile)
+
+    def _script_attr(self, sqlfile):
+        attr = Path(sqlfile).stem
+        if hasattr(type(self), attr):
+            # We have real namespace method which shadows
+            # this file
+            attr = "_" + attr
+        return attr
 
-    def _collect_scripts(self, sqldir):
-        sqlfiles = chain(
-            sqldir.glob("*.{}".format(self.db.file_ext)),
-            sqldir.glob("*.{}".format(self.db.tmpl_ext)),
+    def _reload_script(self, sqlfile):
+        """Reload the cached script of ``sqlfile`` or remove it from
+        the cache if the file does not exist anymore."""
+        stem = Path(sqlfile).stem
+        self._index.update(stem)
+        attr = self._script_attr(sqlfile)
+        try:
+            self._scripts[attr] = self._load_script(self._index.scripts[stem])
+        except (KeyError, FileNotFoundError):
+            self._scripts.pop(attr, None)
+
+    def _load_script(self, sqlfile):
+        is_template = Path(sqlfile).suffix.lower() == "." + self.db.tmpl_ext
+        script = self.db.script_factory(
+            self._index.read(sqlfile),
+            self.echo,
+            is_template,
+            self.db.sqldirs,
+            prepare_params=self.db.prepare_params,
         )
+        if is_template:
+            # Set after construction so that custom script factories
+            # without these arguments keep working.
+            script.cache = self.cache
+            script.module_dir = self.db.tmpl_module_dir
+            script.lookup = self.db.tmpl_lookup
+        return script
 
-        for sqlfile in sqlfiles:
-            filename = Path(sqlfile.name)
-            attr = filename.stem
-            ext = filename.suffix
-
-            if hasattr(self, attr):
-                # We have real namespace method which shadows
-                # this file
-                attr = "_" + attr
-
-            with open(str(sqlfile), "r") as f:
-                self._scripts[attr] = self.db.script_factory(
-                    f.read(),
-                    self.echo,
-                    ext.lower() == "." + self.db.tmpl_ext,
-                    self.db.sqldirs,
-                    prepare_params=self.db.prepare_params,
-                )
+    def _find_file(self, attr):
+        # Rescan the directory at most once per interval to find
+        # new files.
+        if time.monotonic() - self._index.scanned >= self.reload_interval:
+            self._index = DirIndex(
+                self.sqldir, self.db.file_ext, self.db.tmpl_ext
+            )
+        sqlfile = self._index.scripts.get(attr)
+        if sqlfile is not None:
+            try:
+                return sqlfile, file_stat(sqlfile)
+            except FileNotFoundError:
+                pass
+        return None, None
+
+    def _get_script_file(self, attr):
+        """Return the script ``attr`` held in memory and re-read its file
+        only if its modification time or size has changed.
+
+        The file is checked at most once every ``reload_interval`` seconds.
+        """
+        now = time.monotonic()
+        sf = self._files.get(attr)
+        if sf is not None and now - sf.checked < self.reload_interval:
+            return sf.script
+
+        path, stat = None, None
+        if sf is not None and sf.path is not None:
+            try:
+                path, stat = sf.path, file_stat(sf.path)
+            except FileNotFoundError:
+                pass
+        if path is None:
+            path, stat = self._find_file(attr)
+
+        if sf is not None and sf.path == path and sf.stat == stat:
+            sf.checked = now
+            return sf.script
+
+        script = None if path is None else self._load_script(path)
+        self._files[attr] = ScriptFile(script, path, stat, now)
+        return script
 
     def __getattr__(self, attr):
         if self.cache:
@@ -65,20 +361,27 @@ class Namespace(object):
             except KeyError:
                 return getattr(self.shadow, attr)
 
+        if self.reload_interval is not None:
+            script = self._get_script_file(attr)
+            if script is None:
+                return getattr(self.shadow, attr)
+            return script
+
         try:
-            sqlfile = self.sqldir / ".".join((attr, self.db.file_ext))
-            if not sqlfile.is_file():
-                sqlfile = self.sqldir / ".".join((attr, self.db.tmpl_ext))
-            with open(str(sqlfile), "r") as f:
-                return self.db.script_factory(
-                    f.read(),
-                    self.echo,
-                    Path(sqlfile).suffix == "." + self.db.tmpl_ext,
-                    self.db.sqldirs,
-                    prepare_params=self.db.prepare_params,
+            return self._load_script(self._index.scripts[attr])
+        except (KeyError, FileNotFoundError):
+            pass
+        # The file may have been added or removed since the directory
+        # was scanned. Bundles don't change.
+        if isinstance(self._index, DirIndex):
+            try:
+                self._index = DirIndex(
+                    self.sqldir, self.db.file_ext, self.db.tmpl_ext
                 )
-        except FileNotFoundError:
-            return getattr(self.shadow, attr)
+                return self._load_script(self._index.scripts[attr])
+            except (KeyError, FileNotFoundError):
+                pass
+        return getattr(self.shadow, attr)
 
 
 class CursorNamespace(object):
@@ -89,9 +392,13 @@ class CursorNamespace(object):
     def __getattr__(self, attr):
         attr_obj = getattr(self.namespace, attr)
         if isinstance(attr_obj, Script):
-            return CursorScript(attr_obj, self.cursor)
-        if isinstance(attr_obj, types.MethodType):
-            return partial(attr_obj, self.cursor)
+            attr_obj = CursorScript(attr_obj, self.cursor)
+        elif isinstance(attr_obj, types.MethodType):
+            attr_obj = partial(attr_obj, self.cursor)
+        if self.namespace.cache:
+            # Scripts don't change in cache mode. Store the bound
+            # object so that further lookups don't reach __getattr__.
+            self.__dict__[attr] = attr_obj
         return attr_obj
 
     def __call__(self, *args, **kwargs):
@@ -2,7 +2,11 @@
 # pool module and is copyrighted by Michael Bayer under the terms of the
 # MIT license. https://www.sqlalchemy.org/
 
+import logging
 import threading
+import time
+import weakref
+from collections import deque
 from queue import (
     Empty,
     Full,
@@ -13,6 +17,9 @@ from .exc import (
     OperationalError,
     TimeoutError,
 )
+from .metrics import PoolMetrics
+
+log = logging.getLogger(__name__)
 
 
 class Queue(BaseQueue):
@@ -34,6 +41,77 @@ class Queue(BaseQueue):
         self.not_empty = threading.Condition(self.mutex)
         self.all_tasks_done = threading.Condition(self.mutex)
 
+    def _init(self, maxsize):
+        # The idle connections by their autocommit mode. The items are
+        # tuples (conn, idle_since, autocommit).
+        self.queues = {False: deque(), True: deque()}
+
+    def _qsize(self):
+        return len(self.queues[False]) + len(self.queues[True])
+
+    def _put(self, item):
+        self.queues[item[2]].append(item)
+
+    def _get(self, autocommit=False):
+        queue = self.queues[autocommit]
+        if not queue:
+            queue = self.queues[not autocommit]
+        return queue.popleft()
+
+    def items(self):
+        return list(self.queues[False]) + list(self.queues[True])
+
+    def remove(self, item):
+        self.queues[item[2]].remove(item)
+
+    def get(self, block=True, timeout=None, autocommit=False):
+        """Like :meth:`queue.Queue.get` but prefers connections in the
+        given autocommit mode."""
+        with self.not_empty:
+            if not block:
+                if not self._qsize():
+                    raise Empty
+            elif timeout is None:
+                while not self._qsize():
+                    self.not_empty.wait()
+            elif timeout < 0:
+                raise ValueError("'timeout' must be a non-negative number")
+            else:
+                endtime = time.monotonic() + timeout
+                while not self._qsize():
+                    remaining = endtime - time.monotonic()
+                    if remaining <= 0.0:
+                        raise Empty
+                    self.not_empty.wait(remaining)
+            item = self._get(autocommit)
+            self.not_full.notify()
+            return item
+
+
+class Reaper(threading.Thread):
+    """Calls :meth:`Pool.reap` every ``interval`` seconds. Holds only a
+    weak reference to the pool and ends if it is garbage collected."""
+
+    def __init__(self, pool, interval):
+        super().__init__(name="quma-reaper", daemon=True)
+        self.pool = weakref.ref(pool)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            pool = self.pool()
+            if pool is None:
+                return
+            pool.reap()
+            del pool
+
+    def stop(self):
+        """Stop the thread and wait for a running reap to finish."""
+        self.stopped.set()
+        if self is not threading.current_thread():
+            self.join()
+
 
 class Pool(object):
     """A queuing pool of connections"""
@@ -46,9 +124,32 @@ class Pool(object):
         self._overflow_lock = threading.Lock()
         self._pool = Queue(maxsize=size)
         self._pessimistic = kwargs.get("pessimistic", False)
+        self._recycle = kwargs.pop("recycle", None)
+        self._idle_timeout = kwargs.pop("idle_timeout", None)
+        self._min_idle = kwargs.pop("min_idle", 0)
+        reap_interval = kwargs.pop("reap_interval", None)
+        listener = kwargs.pop("listener", None)
+        # The creation times of the connections by id
+        self._created = {}
         self._conn = conn_class(url, **kwargs)
         if self._conn.persist:
             raise ValueError("Persistent connections are not allowed")
+        if reap_interval and self._conn.thread_bound:
+            # The reaper thread opens the prewarmed connections
+            raise ValueError(
+                "reap_interval requires connections which can be shared "
+                "by threads, e. g. check_same_thread=False with SQLite"
+            )
+        self.metrics = PoolMetrics()
+        self._listeners = [self.metrics]
+        if listener is not None:
+            self._listeners.append(listener)
+        # The checkout times of the connections by id
+        self._checked_out = {}
+        self._reaper = None
+        if reap_interval:
+            self._reaper = Reaper(self, reap_interval)
+            self._reaper.start()
 
     def _inc_overflow(self):
         if self._MAX == -1:
@@ -71,29 +172,90 @@ class Pool(object):
         # Always rollback possibly open transaction so that as the
         # connection is set up to be used again, it’s in a “clean”
         # state with no references held to the previous series of
-        # operations.
-        conn.rollback()
-        self._conn.disable_autocommit(conn)
+        # operations. Skipped by the providers if the connection is
+        # already clean. The autocommit mode is kept, see get.
+        autocommit = bool(self._conn.autocommit_enabled(conn))
+        self._conn.reset(conn, autocommit)
+        now = time.monotonic()
+        checked_out = self._checked_out.pop(id(conn), None)
+        if checked_out is not None:
+            self._notify("checkin", conn, now - checked_out)
         try:
-            self._pool.put(conn, False)
+            # Remember when the connection became idle, see _alive
+            self._pool.put((conn, now, autocommit), False)
         except Full:
             try:
-                self._conn.close(conn)
+                self._discard(conn)
             finally:
                 self._dec_overflow()
 
+    def _notify(self, event, *args):
+        # A failing listener must not leak the connection in use
+        for listener in self._listeners:
+            try:
+                getattr(listener, event)(self, *args)
+            except Exception:
+                log.exception("Pool listener %r failed on %s", listener, event)
+
+    def _connect(self, autocommit=False):
+        conn = self._conn.get(autocommit=autocommit)
+        self._created[id(conn)] = time.monotonic()
+        self._notify("connect", conn)
+        return conn
+
+    def _discard(self, conn):
+        self._created.pop(id(conn), None)
+        self._conn.close(conn)
+        self._notify("close", conn)
+
+    def _expired(self, conn, idle_since, now):
+        """Return if ``conn`` is older than ``recycle`` or has been idle
+        longer than ``idle_timeout`` seconds."""
+        if self._recycle is not None:
+            created = self._created.get(id(conn), now)
+            if now - created >= self._recycle:
+                return True
+        if self._idle_timeout is not None:
+            return now - idle_since >= self._idle_timeout
+        return False
+
+    def _replace(self, conn, autocommit):
+        self._discard(conn)
+        try:
+            return self._connect(autocommit=autocommit)
+        except Exception as e:
+            self._dec_overflow()
+            raise e
+
     def get(self, autocommit=False):
+        start = time.monotonic()
+        try:
+            conn = self._checkout(autocommit)
+        except TimeoutError:
+            self._notify("timeout", time.monotonic() - start)
+            raise
+        if conn is not None:
+            now = time.monotonic()
+            self._checked_out[id(conn)] = now
+            self._notify("checkout", conn, now - start)
+        return conn
+
+    def _checkout(self, autocommit):
         use_overflow = self._MAX > -1
 
         try:
             wait = use_overflow and self._overflow >= self._MAX
-            conn = self._pool.get(wait, self._timeout)
-            if self._pessimistic:
-                try:
-                    self._conn.check(conn)
-                except OperationalError:
-                    self._conn.close(conn)
-                    return self._conn.get(autocommit=autocommit)
+            conn, idle_since, mode = self._pool.get(
+                wait, self._timeout, autocommit=autocommit
+            )
+            if self._expired(conn, idle_since, time.monotonic()):
+                return self._replace(conn, autocommit)
+            if self._pessimistic and not self._alive(conn, idle_since):
+                return self._replace(conn, autocommit)
+            if mode != autocommit:
+                # No idle connection in the requested mode
+                self._notify("mode_switch", conn)
+                self._conn.switch_autocommit(conn, autocommit)
             return conn
         except Empty:
             # Don't do things inside of "except Empty", because when we say
@@ -109,28 +271,120 @@ class Pool(object):
 
         if self._inc_overflow() is True:
             try:
-                return self._conn.get(autocommit=autocommit)
+                return self._connect(autocommit=autocommit)
             except Exception as e:
                 self._dec_overflow()
                 raise e
 
+    def reap(self):
+        """Close idle connections which are expired according to
+        ``recycle`` and ``idle_timeout`` and open new ones until at least
+        ``min_idle`` connections are idle. Called periodically by the
+        reaper thread if ``reap_interval`` is set.
+        """
+        now = time.monotonic()
+        queue = self._pool
+        with queue.mutex:
+            expired = [
+                item
+                for item in queue.items()
+                if self._expired(item[0], item[1], now)
+            ]
+            for item in expired:
+                queue.remove(item)
+            if expired:
+                queue.not_full.notify(len(expired))
+        for conn, _, _ in expired:
+            try:
+                self._discard(conn)
+            except Exception:
+                log.exception("Failed to close an expired connection")
+            finally:
+                self._dec_overflow()
+        while self.checkedin < min(self._min_idle, self.size):
+            if self._inc_overflow() is not True:
+                break
+            try:
+                conn = self._connect()
+            except Exception:
+                log.exception("Failed to open an idle connection")
+                self._dec_overflow()
+                break
+            try:
+                self._pool.put((conn, time.monotonic(), False), False)
+            except Full:
+                self._discard(conn)
+                self._dec_overflow()
+                break
+
+    def _alive(self, conn, idle_since):
+        """Return if the idle connection ``conn`` is usable.
+
+        Connections the driver already knows to be broken are discarded
+        without a round trip. The others are only checked on the server
+        if they have been idle for at least ``check_interval`` seconds.
+        """
+        if not self._conn.probe(conn):
+            self._notify("check", conn, True, False)
+            return False
+        if time.monotonic() - idle_since < self._conn.check_interval:
+            return True
+        try:
+            self._conn.check(conn)
+        except OperationalError:
+            self._notify("check", conn, True, True)
+            return False
+        self._notify("check", conn, False, True)
+        return True
+
     def cursor(self, conn):
         return conn.cursor()
 
     def get_cursor_attr(self, cursor, key):
         return self._conn.get_cursor_attr(cursor, key)
 
+    def stream_cursor(self, conn, size):
+        return self._conn.stream_cursor(conn, size)
+
+    def close_stream_cursor(self, cursor):
+        self._conn.close_stream_cursor(cursor)
+
+    def execute(self, conn, cursor, content, params):
+        self._conn.execute(conn, cursor, content, params)
+
+    def executemany(self, cursor, content, params):
+        self._conn.executemany(cursor, content, params)
+
+    def copy(self, cursor, table, rows, columns=None):
+        return self._conn.copy(cursor, table, rows, columns=columns)
+
+    def limit_query(self, content, limit):
+        return self._conn.limit_query(content, limit)
+
+    def count_query(self, content):
+        return self._conn.count_query(content)
+
+    def exists_query(self, content):
+        return self._conn.exists_query(content)
+
     @property
     def has_rowcount(self):
         return self._conn.has_rowcount
 
     def close(self):
+        # Stop the reaper first, otherwise a running reap could open
+        # connections after the queue has been drained.
+        if self._reaper is not None:
+            self._reaper.stop()
+            self._reaper = None
         while True:
             try:
-                conn = self._pool.get(False)
-                conn.close()
+                conn, _, _ = self._pool.get(False)
             except Empty:
                 break
+            self._created.pop(id(conn), None)
+            conn.close()
+            self._notify("close", conn)
 
         self._overflow = 0 - self.size
 
@@ -142,10 +396,44 @@ class Pool(object):
             % (self.size, self.checkedin, self.overflow, self.checkedout)
         )
 
+    def stats(self):
+        """Return the current state of the pool and its metrics, see
+        :meth:`quma.metrics.PoolMetrics.snapshot`."""
+        stats = self.metrics.snapshot()
+        stats.update(
+            size=self.size,
+            checkedin=self.checkedin,
+            checkedout=self.checkedout,
+            overflow=self.overflow,
+        )
+        return stats
+
+    @property
+    def checks(self):
+        return self.metrics.checks
+
+    @property
+    def failed_checks(self):
+        return self.metrics.failed_checks
+
+    @property
+    def mode_switches(self):
+        return self.metrics.mode_switches
+
     @property
     def size(self):
         return self._pool.maxsize
 
+    @property
+    def thread_bound(self):
+        return self._conn.thread_bound
+
+    @property
+    def max_connections(self):
+        if self._MAX == -1:
+            return None
+        return self.size + self._MAX
+
     @property
     def checkedin(self):
         return self._pool.qsize()
@@ -1,8 +1,13 @@
+import re
+
 try:
     import MySQLdb
+    from MySQLdb.connections import Connection as MySQLConnection
     from MySQLdb.cursors import (
         Cursor,
         DictCursor,
+        SSCursor,
+        SSDictCursor,
     )
 except ImportError as e:
     raise ImportError(
@@ -12,26 +17,90 @@ except ImportError as e:
 from .. import (
     conn,
     exc,
+    rows,
 )
 
+# Statements which open a transaction in autocommit mode
+BEGIN_RE = re.compile(rb"^\s*(?:begin|start\s+transaction|xa\s+start)\b", re.I)
+
+
+class TrackingConnection(MySQLConnection):
+    """Tracks if a transaction may be open. mysqlclient doesn't expose
+    the transaction status, so every statement sent outside autocommit
+    mode marks the connection as dirty until it is committed or rolled
+    back. See :meth:`Connection.reset`."""
+
+    quma_dirty = False
+
+    def query(self, query):
+        if not self.get_autocommit() or BEGIN_RE.match(
+            query.encode("utf-8") if isinstance(query, str) else query
+        ):
+            self.quma_dirty = True
+        super().query(query)
+
+    def commit(self):
+        super().commit()
+        self.quma_dirty = False
+
+    def rollback(self):
+        super().rollback()
+        self.quma_dirty = False
+
+
+class CompactCursor(rows.CompactRowsMixin, Cursor):
+    pass
+
+
+class CompactSSCursor(rows.CompactRowsMixin, SSCursor):
+    pass
+
 
 class Connection(conn.Connection):
     def __init__(self, url, **kwargs):
         super().__init__(url, kwargs)
         self.hostname = self.url.hostname or "localhost"
         self.port = self.url.port or 3306
-        if kwargs.pop("dict_cursor", False):
+        # mysqlclient's executemany sends INSERT ... VALUES statements
+        # with multiple rows of at most max_stmt_length bytes.
+        self.max_stmt_length = kwargs.pop("max_stmt_length", None)
+        dict_cursor = kwargs.pop("dict_cursor", False)
+        if self.compact_rows:
+            self.cursor_factory = CompactCursor
+            self.stream_cursor_factory = CompactSSCursor
+        elif dict_cursor:
             self.cursor_factory = DictCursor
+            self.stream_cursor_factory = SSDictCursor
         else:
             self.cursor_factory = Cursor
+            self.stream_cursor_factory = SSCursor
         self._init_conn()
 
     def cursor(self, conn):
-        return conn.cursor()
+        cursor = conn.cursor()
+        if self.max_stmt_length:
+            cursor.max_stmt_length = self.max_stmt_length
+        return cursor
+
+    def stream_cursor(self, conn, size):
+        # An unbuffered cursor which reads the rows from the server
+        # while they are fetched.
+        return conn.cursor(self.stream_cursor_factory)
+
+    def close_stream_cursor(self, cursor):
+        # The connection can't be used again before all rows of an
+        # unbuffered result are read.
+        try:
+            while cursor.fetchmany(1000):
+                pass
+        except MySQLdb.Error:
+            pass
+        finally:
+            cursor.close()
 
     def create_conn(self, **kwargs):
         try:
-            conn = MySQLdb.connect(
+            conn = TrackingConnection(
                 db=self.database,
                 user=self.username,
                 passwd=self.password,
@@ -53,12 +122,28 @@ class Connection(conn.Connection):
         conn.autocommit(False)
         return conn
 
+    def autocommit_enabled(self, conn):
+        # Reads the status of the last server response while
+        # conn.autocommit() is a round trip.
+        return conn.get_autocommit()
+
+    def in_transaction(self, conn):
+        return conn.quma_dirty
+
+    def limit_query(self, content, limit):
+        # MySQL may ignore the ORDER BY clause of derived tables and
+        # rejects duplicate column names in them.
+        return None
+
+    def count_query(self, content):
+        return None
+
     def mogrify(self, cursor, content, params):
         return cursor._executed.decode("utf-8")
 
     def _check(self, conn):
+        # ping() is a COM_PING packet which needs no statement parsing
         try:
-            cur = conn.cursor()
-            cur.execute("SELECT 1")
+            conn.ping()
         except MySQLdb.OperationalError as e:
             raise exc.OperationalError from e
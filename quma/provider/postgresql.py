@@ -1,3 +1,13 @@
+import datetime
+import decimal
+import re
+import uuid
+from functools import lru_cache
+from itertools import (
+    chain,
+    count,
+)
+
 try:
     import psycopg2
 except ImportError as e:
@@ -7,17 +17,164 @@ except ImportError as e:
     ) from e
 
 
+from psycopg2 import sql
 from psycopg2.extras import (
     DictCursor,
     DictRow,
+    execute_batch,
 )
 
 from .. import (
     conn,
     exc,
+    rows,
+)
+
+# Server side cursors need a name which is unique per connection
+STREAM_IDS = count()
+
+# Statements which can be prepared. Leading comments are allowed.
+PREPARABLE_RE = re.compile(
+    r"^\s*(?:--[^\n]*\n\s*|/\*.*?\*/\s*)*"
+    r"(?:select|insert|update|delete|values|with)\b",
+    re.I | re.S,
+)
+# The placeholders of psycopg2 and escaped percent signs
+PLACEHOLDER_RE = re.compile(r"%\(([^)]+)\)s|%s|%%")
+
+# The number of characters psycopg2 reads at once while copying
+COPY_SIZE = 65536
+COPY_ESCAPES = str.maketrans(
+    {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"}
 )
 
 
+def copy_text(value):
+    """Return the PostgreSQL text representation of the scalar ``value``.
+
+    Raises ``TypeError`` for types without a representation as text,
+    e. g. dicts, which psycopg2 does not adapt either.
+    """
+    if value is True:
+        return "t"
+    if value is False:
+        return "f"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        # bytea hex format
+        return "\\x" + bytes(value).hex()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        # The interval format psycopg2 uses
+        return "{} days {}.{:06d} seconds".format(
+            value.days, value.seconds, value.microseconds
+        )
+    if isinstance(value, (str, int, float, decimal.Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(
+        "Values of type {} can't be copied".format(type(value).__name__)
+    )
+
+
+def array_literal(values):
+    """Return the array literal of the list or tuple ``values``."""
+    items = []
+    for value in values:
+        if value is None:
+            items.append("NULL")
+        elif isinstance(value, (list, tuple)):
+            items.append(array_literal(value))
+        else:
+            text = copy_text(value).replace("\\", "\\\\")
+            items.append('"{}"'.format(text.replace('"', '\\"')))
+    return "{{{}}}".format(",".join(items))
+
+
+def encode_copy_value(value):
+    """Encode ``value`` for the text format of COPY. Lists and tuples
+    are encoded as arrays."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, (list, tuple)):
+        text = array_literal(value)
+    else:
+        text = copy_text(value)
+    return text.translate(COPY_ESCAPES)
+
+
+@lru_cache(maxsize=512)
+def prepared_statement(content):
+    """Translate the statement ``content`` to the body of a ``PREPARE``
+    and the parameter list of the ``EXECUTE`` statement.
+
+    The placeholders are replaced with ``$1``, ``$2`` ... and the values
+    are passed to ``EXECUTE`` using the placeholders of the original
+    style. Returns ``None`` if ``content`` can't be prepared, e. g. if
+    it contains multiple statements or mixes placeholder styles.
+    """
+    content = content.strip().rstrip(";").rstrip()
+    if not PREPARABLE_RE.match(content) or ";" in content or "$" in content:
+        return None
+    names, positional = [], []
+
+    def replace(match):
+        if match.group(0) == "%%":
+            return "%"
+        if match.group(1) is None:
+            positional.append("%s")
+            return "${}".format(len(positional))
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return "${}".format(names.index(name) + 1)
+
+    body = PLACEHOLDER_RE.sub(replace, content)
+    if names and positional:
+        return None
+    if names:
+        args = ["%({})s".format(name.replace("%", "%%")) for name in names]
+    else:
+        args = positional
+    return body, " ({})".format(", ".join(args)) if args else ""
+
+
+class CopyReader(object):
+    """A file-like object which encodes ``rows`` to the text format of
+    COPY as they are read, so that only about ``size`` characters are
+    held in memory at once.
+
+    :param rows: An iterable of sequences or dicts.
+    :param columns: The keys of dict rows in column order.
+    """
+
+    def __init__(self, rows, columns=None):
+        self.rows = iter(rows)
+        self.columns = columns
+        self.count = 0
+        self._buffer = ""
+
+    def encode(self, row):
+        if isinstance(row, dict):
+            row = [row[column] for column in self.columns]
+        return "\t".join(map(encode_copy_value, row)) + "\n"
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        for row in self.rows:
+            line = self.encode(row)
+            chunks.append(line)
+            length += len(line)
+            self.count += 1
+            if 0 <= size <= length:
+                break
+        data = "".join(chunks)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+
 class PostgresChangelingRow(DictRow):
     """
     A row object that allows by-column-name access to data.
@@ -80,13 +237,29 @@ class PostgresChangelingCursor(DictCursor):
         self._prefetch = 1
 
 
+class PostgresCompactCursor(rows.CompactRowsMixin, psycopg2.extensions.cursor):
+    def __iter__(self):
+        while True:
+            batch = self.fetchmany(self.itersize)
+            if not batch:
+                return
+            yield from batch
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """A connection which can hold the registry of its prepared
+    statements, see ``Connection.prepared_statements``."""
+
+
 class Connection(conn.Connection):
     def __init__(self, url, **kwargs):
         super().__init__(url, kwargs)
 
         self.hostname = self.url.hostname or "localhost"
         self.port = self.url.port or 5432
-        if self.changeling:
+        if self.compact_rows:
+            self.factory = PostgresCompactCursor
+        elif self.changeling:
             self.factory = PostgresChangelingCursor
         else:
             self.factory = psycopg2.extras.DictCursor
@@ -111,7 +284,27 @@ class Connection(conn.Connection):
             return fetch
         return getattr(cursor, key)
 
+    def stream_cursor(self, conn, size):
+        # A named cursor. Outside of transactions, i. e. in autocommit
+        # mode, it must be declared WITH HOLD.
+        cursor = conn.cursor(
+            name="quma_stream_{}".format(next(STREAM_IDS)),
+            withhold=conn.autocommit,
+        )
+        cursor.itersize = size
+        return cursor
+
+    def close_stream_cursor(self, cursor):
+        # Closing a named cursor in a failed transaction raises an error.
+        # The cursor is gone with the transaction anyway.
+        try:
+            cursor.close()
+        except psycopg2.Error:
+            pass
+
     def create_conn(self, **kwargs):
+        if self.prepare:
+            kwargs.setdefault("connection_factory", PreparingConnection)
         try:
             return psycopg2.connect(
                 database=self.database,
@@ -134,12 +327,115 @@ class Connection(conn.Connection):
         conn.autocommit = False
         return conn
 
+    def autocommit_enabled(self, conn):
+        return conn.autocommit
+
+    def in_transaction(self, conn):
+        # The transaction status is known by libpq without a round trip.
+        # Broken connections have an unknown status and are rolled back,
+        # which raises an error.
+        return (
+            conn.get_transaction_status()
+            != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        )
+
+    def execute(self, conn, cursor, content, params):
+        if not self.prepare:
+            cursor.execute(content, params)
+            return
+        statement = prepared_statement(content)
+        if statement is None:
+            cursor.execute(content, params)
+            return
+        statements = self.prepared_statements(conn)
+        name = statements.lookup(content)
+        if name is None:
+            if not statements.hit(content):
+                cursor.execute(content, params)
+                return
+            for evicted in statements.evict():
+                cursor.execute("DEALLOCATE {}".format(evicted))
+            name = statements.new_name()
+            if not self._prepare(conn, cursor, name, statement[0]):
+                statements.reject(content)
+                cursor.execute(content, params)
+                return
+            statements.add(content, name)
+        cursor.execute("EXECUTE {}{}".format(name, statement[1]), params)
+
+    def _prepare(self, conn, cursor, name, body):
+        """Prepare ``body`` as statement ``name``. Return ``False`` if
+        PostgreSQL refuses to prepare it, e. g. if it can't determine
+        the type of a parameter."""
+        prepare = "PREPARE {} AS {}".format(name, body)
+        if conn.autocommit:
+            try:
+                cursor.execute(prepare)
+            except psycopg2.ProgrammingError:
+                return False
+            return True
+        # Don't let a failing PREPARE abort the current transaction
+        cursor.execute("SAVEPOINT quma_prepare")
+        try:
+            cursor.execute(prepare)
+        except psycopg2.ProgrammingError:
+            cursor.execute("ROLLBACK TO SAVEPOINT quma_prepare")
+            return False
+        finally:
+            cursor.execute("RELEASE SAVEPOINT quma_prepare")
+        return True
+
+    def executemany(self, cursor, content, params):
+        # psycopg2's executemany does one round trip per item.
+        # execute_batch sends pages of statements instead.
+        execute_batch(cursor, content, params)
+
+    def copy(self, cursor, table, rows, columns=None):
+        """Stream ``rows`` into ``table`` with ``COPY ... FROM STDIN``.
+
+        :param table: The name of the table, optionally qualified with
+            the schema, e. g. ``'public.users'``.
+        :param rows: An iterable of sequences or dicts.
+        :param columns: The names of the columns. Defaults to the keys
+            of the first row if it is a dict and all columns of the
+            table otherwise.
+        :return: The number of copied rows.
+        """
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return 0
+        if columns is None and isinstance(first, dict):
+            columns = list(first)
+        target = sql.Identifier(*table.split("."))
+        if columns:
+            target = sql.SQL("{} ({})").format(
+                target, sql.SQL(", ").join(map(sql.Identifier, columns))
+            )
+        query = sql.SQL("COPY {} FROM STDIN").format(target)
+        reader = CopyReader(chain((first,), rows), columns)
+        cursor.copy_expert(query, reader, size=COPY_SIZE)
+        return reader.count
+
     def mogrify(self, cursor, content, params):
         return cursor.mogrify(content, params).decode("utf-8")
 
+    def probe(self, conn):
+        # libpq reports an unknown transaction status if the connection
+        # is bad.
+        return conn.closed == 0 and (
+            conn.get_transaction_status()
+            != psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+        )
+
     def _check(self, conn):
         try:
             cur = conn.cursor()
             cur.execute("SELECT 1")
+            cur.close()
+            # Outside autocommit mode the check begins a transaction,
+            # which would prevent switching the autocommit mode.
+            if not conn.autocommit:
+                conn.rollback()
         except psycopg2.OperationalError as e:
             raise exc.OperationalError from e
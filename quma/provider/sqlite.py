@@ -2,10 +2,19 @@ import sqlite3
 
 from .. import (
     PLATFORM,
+    batch,
     conn,
     exc,
+    rows,
 )
 
+# The maximum number of parameters of a statement, i. e. the default
+# of SQLITE_MAX_VARIABLE_NUMBER.
+if sqlite3.sqlite_version_info >= (3, 32, 0):
+    MAX_VARIABLES = 32766
+else:
+    MAX_VARIABLES = 999
+
 
 class SQLiteChangelingRow(sqlite3.Row):
     """
@@ -66,6 +75,10 @@ class Connection(conn.Connection):
         self.has_rowcount = False
         self._init_conn()
 
+    @property
+    def thread_bound(self):
+        return self.dbapi_kwargs.get("check_same_thread", True)
+
     def cursor(self, conn):
         return conn.cursor()
 
@@ -74,10 +87,16 @@ class Connection(conn.Connection):
             conn = sqlite3.connect(database=self.database, **kwargs)
         except sqlite3.Error as e:
             raise exc.ConnectionError(e) from e
-        if self.changeling:
+        if self.compact_rows:
+            conn.row_factory = rows.sqlite_row
+        elif self.changeling:
             conn.row_factory = SQLiteChangelingRow
         return self.disable_autocommit(conn)
 
+    def executemany(self, cursor, content, params):
+        # Execute single row INSERTs with multi-row statements
+        batch.executemany(cursor, content, params, MAX_VARIABLES)
+
     def enable_autocommit_if(self, autocommit, conn):
         if autocommit:
             conn.isolation_level = None
@@ -87,6 +106,25 @@ class Connection(conn.Connection):
         conn.isolation_level = "DEFERRED"
         return conn
 
+    def autocommit_enabled(self, conn):
+        return conn.isolation_level is None
+
+    def in_transaction(self, conn):
+        return conn.in_transaction
+
+    def limit_query(self, content, limit):
+        # SQLite renames duplicate column names of derived tables,
+        # e. g. ``id`` and ``id:1``, so the rows would change keys.
+        return None
+
+    def probe(self, conn):
+        # Accessing a closed connection raises an error
+        try:
+            conn.in_transaction  # noqa: B018
+        except sqlite3.ProgrammingError:
+            return False
+        return True
+
     def _check(self, conn):
         try:
             cur = conn.cursor()
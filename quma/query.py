@@ -1,5 +1,23 @@
+from functools import partial
+
 from . import exc
 
+# The number of rows fetched per fetchmany call when streaming
+STREAM_SIZE = 1000
+
+
+def fetch_batches(cursor, size):
+    """Yield the rows of ``cursor`` fetched in batches of ``size`` rows."""
+    while True:
+        try:
+            rows = cursor.fetchmany(size)
+        except exc.FetchError as e:
+            raise e.error from e
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
 
 class ManyResult(object):
     def __init__(self, query):
@@ -8,7 +26,12 @@ class ManyResult(object):
         self._has_been_executed = False
 
     def _run(self):
-        self.query.run()
+        stream_cursor = self.query._stream_cursor()
+        if stream_cursor is None:
+            self.query.run()
+        else:
+            self.query._execute(stream_cursor)
+            self.cursor = stream_cursor
         self._has_been_executed = True
 
     def get(self, size=None):
@@ -17,9 +40,9 @@ class ManyResult(object):
         :param size: The number of rows to be returned. If not
             given use the default value of the driver.
         """
-        size = self.cursor.arraysize if size is None else size
         if not self._has_been_executed:
             self._run()
+        size = self.cursor.arraysize if size is None else size
         return self.cursor.fetchmany(size)
 
 
@@ -27,61 +50,214 @@ class Query(object):
     """
     The query object is the value you get when you run a query,
     i. e. call a :class:`Script` object.
+
+    :param stream: If ``True`` or the number of rows per batch, iterating
+        over the query fetches the rows in batches and does not keep them.
+        Defaults to the ``stream`` parameter of the database.
     """
 
-    def __init__(self, script, cursor, args, kwargs, prepare_params):
+    def __init__(
+        self, script, cursor, args, kwargs, prepare_params, stream=None
+    ):
         self.script = script
         self.cursor = cursor
         self.args = args
         self.kwargs = kwargs
         self.prepare_params = prepare_params
+        self.stream = cursor.db.stream if stream is None else stream
+        self.rewrite = cursor.db.rewrite
         self._has_been_executed = False
+        self._has_been_streamed = False
         self._result_cache = None
+        # The leading rows fetched by first(), one() or exists()
+        self._rows = []
+        # True if _rows holds the complete result
+        self._complete = False
+        # True if the executed statement has been rewritten
+        self._rewritten = False
+        # The number of rows once it is known
+        self._count = None
 
     def run(self):
         """Execute the query using the DBAPI driver."""
+        return self._run()
+
+    def _run(self, rewrite=None):
+        """Execute the query. ``rewrite`` is a method of the connection
+        which returns the rewritten statement or ``None`` if it can't be
+        rewritten."""
+        rewritten = False
+
+        def apply(content):
+            nonlocal rewritten
+            result = rewrite(content)
+            if result is None:
+                return content
+            rewritten = True
+            return result
+
         self.script.execute(
-            self.cursor, list(self.args), self.kwargs, self.prepare_params
+            self.cursor,
+            list(self.args),
+            self.kwargs,
+            self.prepare_params,
+            rewrite=None if rewrite is None else apply,
         )
         self._has_been_executed = True
+        self._has_been_streamed = False
         self._result_cache = None
+        self._rows = []
+        self._complete = False
+        self._rewritten = rewritten
+        # Keep the rowcount as fetch calls may overwrite it
+        self._count = None
+        if not rewritten and self.cursor.has_rowcount:
+            rowcount = self.cursor.rowcount
+            if rowcount >= 0:
+                self._count = rowcount
         return self
 
+    def _is_fetchable(self):
+        """Return if the cursor holds the unconsumed result of the
+        original statement."""
+        return (
+            self._has_been_executed
+            and not self._has_been_streamed
+            and not self._rewritten
+        )
+
     def _fetch(self):
-        if not self._has_been_executed:
-            self.run()
         if self._result_cache is None:
+            if self._rewritten and self._complete:
+                # The limit did not cut the result
+                self._result_cache = self._rows
+                return self._result_cache
+            if not self._is_fetchable():
+                self.run()
             try:
-                self._result_cache = self.cursor.fetchall()
+                rows = self.cursor.fetchall()
             except exc.FetchError as e:
                 raise e.error from e
+            if self._rows:
+                rows = type(rows)(self._rows) + rows
+            self._result_cache = rows
         return self._result_cache
 
+    def _fetch_rows(self, size):
+        """Return at most the first ``size`` rows of the result without
+        fetching more rows than needed."""
+        if self._result_cache is not None:
+            return self._result_cache[:size]
+        if self._has_been_executed and not self._has_been_streamed:
+            if len(self._rows) >= size or self._complete:
+                return self._rows[:size]
+        if not self._is_fetchable():
+            if self.rewrite:
+                self._run(partial(self.cursor.conn.limit_query, limit=size))
+            else:
+                self.run()
+        missing = size - len(self._rows)
+        try:
+            rows = self.cursor.fetchmany(missing)
+        except exc.FetchError as e:
+            raise e.error from e
+        self._rows.extend(rows)
+        self._complete = len(rows) < missing
+        return self._rows[:size]
+
     def __getattr__(self, key):
         return getattr(self.cursor, key)
 
     def __getitem__(self, index):
         return self._fetch()[index]
 
-    def __iter__(self):
-        for row in self._fetch():
+    @property
+    def stream_size(self):
+        """The number of rows fetched at once while streaming."""
+        return STREAM_SIZE if self.stream is True else self.stream
+
+    def _stream_cursor(self):
+        """Return a server side cursor to stream the result if streaming
+        is enabled and supported by the DBMS, otherwise ``None``."""
+        if not self.stream:
+            return None
+        return self.cursor.stream_cursor(self.stream_size)
+
+    def _execute(self, cursor):
+        self.script.execute(
+            cursor, list(self.args), self.kwargs, self.prepare_params
+        )
+
+    def _stream_from(self, stream_cursor, size):
+        try:
+            self._execute(stream_cursor)
+            yield from fetch_batches(stream_cursor, size)
+        finally:
+            stream_cursor.close()
+
+    def _stream(self):
+        # Streamed rows are gone, so the query must be executed again
+        # on further iterations.
+        if not self._is_fetchable():
+            stream_cursor = self._stream_cursor()
+            if stream_cursor is not None:
+                yield from self._stream_from(stream_cursor, self.stream_size)
+                return
+            self.run()
+        self._has_been_streamed = True
+        for row in self._rows:
             yield row
+        yield from fetch_batches(self.cursor, self.stream_size)
+
+    def __iter__(self):
+        if self.stream and self._result_cache is None:
+            yield from self._stream()
+        else:
+            for row in self._fetch():
+                yield row
 
     def __bool__(self):
-        return len(self._fetch()) > 0
+        return len(self._fetch_rows(1)) > 0
 
     def _len(self):
-        self.run()
-        if self.cursor.has_rowcount:
-            return self.cursor.rowcount
-        else:
-            return len(self._fetch())
+        if self._count is None:
+            self._count = self._count_rows()
+        return self._count
+
+    def _count_rows(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        if self._complete:
+            return len(self._rows)
+        if not self._is_fetchable():
+            self.run()
+            if self._count is not None:
+                return self._count
+        if self.stream:
+            # Count the rows without keeping them
+            return sum(1 for _ in self._stream())
+        return len(self._fetch())
 
     def __len__(self):
         return self._len()
 
-    def count(self):
-        """Return the length of the result."""
+    def count(self, server=False):
+        """Return the length of the result.
+
+        The query is executed only if it has not been executed yet.
+
+        :param server: If ``True`` and the length is not known yet, the
+            statement is wrapped with ``SELECT count(*) FROM (...)`` so
+            that the rows are counted by the DBMS instead of being
+            fetched. Only single plain ``SELECT`` statements are wrapped.
+        """
+        if server and self._count is None and self._result_cache is None:
+            self._run(self.cursor.conn.count_query)
+            if self._rewritten:
+                try:
+                    self._count = self.cursor.fetchone()[0]
+                except exc.FetchError as e:
+                    raise e.error from e
         return self._len()
 
     def all(self):
@@ -91,24 +267,15 @@ class Query(object):
     def one(self):
         """Get exactly one row and check if only one exists,
         otherwise raise an error.
-        """
-        if not self._has_been_executed:
-            self.run()
-
-        def check_rowcount(rowcount):
-            if rowcount == 0:
-                raise exc.DoesNotExistError()
-            if rowcount > 1:
-                raise exc.MultipleRowsError()
 
-        # SQLite does not support rowcount
-        if self.cursor.has_rowcount:
-            check_rowcount(self.cursor.rowcount)
-            result = self._fetch()
-        else:
-            result = self._fetch()
-            check_rowcount(len(result))
-        return result[0]
+        Fetches at most two rows.
+        """
+        rows = self._fetch_rows(2)
+        if len(rows) == 0:
+            raise exc.DoesNotExistError()
+        if len(rows) > 1:
+            raise exc.MultipleRowsError()
+        return rows[0]
 
     def value(self, key=0):
         """Call :func:`one` and return the first column by default.
@@ -119,15 +286,27 @@ class Query(object):
 
     def first(self):
         """Get exactly one row and return None if there is no
-        row present in the result."""
-        try:
-            return self._fetch()[0]
-        except IndexError:
-            return None
+        row present in the result. Fetches only the first row."""
+        rows = self._fetch_rows(1)
+        return rows[0] if rows else None
 
     def exists(self):
-        """Return if the query's result has rows."""
-        return self._len() > 0
+        """Return if the query's result has rows.
+
+        Fetches at most one row. If the query has not been executed yet
+        and the database has been initialized with ``rewrite=True``
+        a ``SELECT EXISTS (...)`` query is executed instead.
+        """
+        if self.rewrite and not self._has_been_executed:
+            self._run(self.cursor.conn.exists_query)
+            if self._rewritten:
+                return bool(self.cursor.fetchone()[0])
+        if self._fetch_rows(1):
+            return True
+        # DML statements without a result, e. g. an UPDATE
+        if self.cursor.description is None and self.cursor.has_rowcount:
+            return self.cursor.rowcount > 0
+        return False
 
     def many(self):
         """Return a ManyResult object initialized with
@@ -143,10 +322,9 @@ class Query(object):
             of the driver.
         """
         size = self.cursor.arraysize if size is None else size
+        stream_cursor = self._stream_cursor()
+        if stream_cursor is not None:
+            yield from self._stream_from(stream_cursor, size)
+            return
         self.run()
-        while True:
-            results = self.cursor.fetchmany(size)
-            if not results:
-                break
-            for result in results:
-                yield result
+        yield from fetch_batches(self.cursor, size)
@@ -0,0 +1,144 @@
+"""Compact row types.
+
+For each distinct result description a subclass of :class:`Row`, a
+tuple, is generated and cached. Columns are accessed by index, by key
+(``row['name']``) and by attribute (``row.name``) where the attribute
+is a property generated for the column.
+"""
+
+from functools import lru_cache
+from operator import itemgetter
+
+# The maximum number of cached row classes
+CACHE_SIZE = 256
+
+
+def make_row(fields, values):
+    return row_class(fields)(values)
+
+
+class Row(tuple):
+    """The base class of compact rows."""
+
+    __slots__ = ()
+    _fields = ()
+    _positions = {}
+
+    def __getitem__(self, key, _getitem=tuple.__getitem__):
+        if key.__class__ is str:
+            return _getitem(self, self._positions[key])
+        return _getitem(self, key)
+
+    def __getattr__(self, attr):
+        # Only called if there is no column and no member named attr
+        raise AttributeError(
+            'Row has no field with the name "{}"'.format(attr)
+        )
+
+    def __reduce__(self):
+        # The generated classes can't be pickled by reference
+        return make_row, (self._fields, tuple(self))
+
+    def __repr__(self):
+        return "Row({})".format(
+            ", ".join(
+                "{}={!r}".format(field, tuple.__getitem__(self, i))
+                for i, field in enumerate(self._fields)
+            )
+        )
+
+    def keys(self):
+        return list(self._fields)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except (KeyError, IndexError):
+            return default
+
+    def _asdict(self):
+        return {
+            field: tuple.__getitem__(self, i)
+            for i, field in enumerate(self._fields)
+        }
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def row_class(fields):
+    """Return the row class for the column names ``fields``.
+
+    If a column has the name of a member of :class:`Row` like ``keys``
+    or ``count`` the member is available with a leading underscore,
+    e. g. ``row._keys()``.
+    """
+    namespace = {
+        "__slots__": (),
+        "_fields": fields,
+        "_positions": {field: i for i, field in enumerate(fields)},
+    }
+    for i, field in enumerate(fields):
+        if (
+            field in namespace
+            or field.startswith("__")
+            or (field.startswith("_") and hasattr(Row, field))
+        ):
+            # Duplicate columns and names of private members are
+            # accessible by index and key only.
+            continue
+        if hasattr(Row, field):
+            namespace.setdefault("_" + field, getattr(Row, field))
+        namespace[field] = property(itemgetter(i))
+    return type("Row", (Row,), namespace)
+
+
+# Maps the ids of cursor descriptions to their row classes. The
+# description is kept so that its id is not reused while cached.
+_classes = {}
+
+
+def description_class(description):
+    """Return the row class of a DBAPI cursor ``description``."""
+    try:
+        cached, cls = _classes[id(description)]
+        if cached is description:
+            return cls
+    except KeyError:
+        pass
+    cls = row_class(tuple(column[0] for column in description))
+    if len(_classes) >= CACHE_SIZE:
+        _classes.clear()
+    _classes[id(description)] = (description, cls)
+    return cls
+
+
+def sqlite_row(cursor, row):
+    """A row factory for :mod:`sqlite3` connections."""
+    return description_class(cursor.description)(row)
+
+
+class CompactRowsMixin(object):
+    """Makes the fetch methods of DBAPI cursor classes return compact
+    rows."""
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is None:
+            return None
+        return description_class(self.description)(row)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            rows = super().fetchmany()
+        else:
+            rows = super().fetchmany(size)
+        if not rows:
+            return rows
+        cls = description_class(self.description)
+        return [cls(row) for row in rows]
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if not rows:
+            return rows
+        cls = description_class(self.description)
+        return [cls(row) for row in rows]
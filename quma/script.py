@@ -1,27 +1,133 @@
+import hashlib
+import importlib.util
+import os
 import sys
+import tempfile
+from functools import lru_cache
+from itertools import islice
 
 from .query import Query
 
 try:
+    import mako
+    from mako.codegen import MAGIC_NUMBER
     from mako.lookup import TemplateLookup
-    from mako.template import Template
+    from mako.template import (
+        ModuleTemplate,
+        Template,
+    )
 except ImportError:
     Template = None
 
+# The maximum number of compiled templates held in memory. Applies
+# to the shared cache of script templates as well as to the included
+# or imported files of each template lookup.
+TEMPLATE_CACHE_SIZE = 512
+
+# The number of parameter sets passed to a single executemany call
+CHUNK_SIZE = 1000
+
+
+def chunked(rows, size):
+    """Yield lists of at most ``size`` items of the iterable ``rows``."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def sqldirs_key(sqldirs):
+    """Return ``sqldirs`` as hashable tuple of strings."""
+    if isinstance(sqldirs, (str, os.PathLike)):
+        sqldirs = [sqldirs]
+    return tuple(str(sqldir) for sqldir in sqldirs)
+
+
+@lru_cache(maxsize=32)
+def get_lookup(sqldirs, filesystem_checks=True, module_dir=None):
+    """Return a shared ``TemplateLookup`` for the given sqldirs.
+
+    If ``filesystem_checks`` is ``False`` included files are compiled
+    once and never checked for modifications. If ``module_dir`` is
+    given mako stores the compiled modules of included files there.
+    """
+    return TemplateLookup(
+        directories=list(sqldirs),
+        filesystem_checks=filesystem_checks,
+        collection_size=TEMPLATE_CACHE_SIZE,
+        module_directory=module_dir,
+    )
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(content, lookup, module_dir=None):
+    if module_dir is None:
+        return Template(content, lookup=lookup)
+    return load_template_module(content, lookup, module_dir)
+
+
+def load_template_module(content, lookup, module_dir):
+    """Load the compiled template of ``content`` from ``module_dir``.
+
+    The module file is keyed by the hash of the content and the mako
+    version. If it does not exist or was written by an incompatible
+    version of mako the template is compiled and the module written.
+    """
+    key = hashlib.sha1(
+        "{}\n{}".format(mako.__version__, content).encode("utf-8")
+    ).hexdigest()
+    uri = "quma_{}".format(key)
+    path = os.path.join(module_dir, "{}.py".format(uri))
+
+    if os.path.isfile(path):
+        spec = importlib.util.spec_from_file_location(
+            "quma.templates.{}".format(uri), path
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        if getattr(module, "_magic_number", None) == MAGIC_NUMBER:
+            return ModuleTemplate(module, module_filename=path, lookup=lookup)
+
+    template = Template(content, lookup=lookup, uri=uri)
+    os.makedirs(module_dir, exist_ok=True)
+    # Write to a temporary file first and move it into place so that
+    # concurrent processes never load a partially written module.
+    fd, tmppath = tempfile.mkstemp(dir=module_dir, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(template.code)
+    os.replace(tmppath, path)
+    return template
+
 
 class Script(object):
     def __init__(
-        self, content, echo, is_template, sqldirs, prepare_params=None
+        self,
+        content,
+        echo,
+        is_template,
+        sqldirs,
+        prepare_params=None,
+        cache=False,
+        module_dir=None,
+        lookup=None,
     ):
         self.echo = echo
         self.content = content
         self.prepare_params = prepare_params
         self.is_template = is_template
         self.sqldirs = sqldirs
+        self.cache = cache
+        self.module_dir = module_dir
+        self.lookup = lookup
         self.params = None
+        self._template = None
 
-    def __call__(self, cursor, *args, prepare_params=None, **kwargs):
-        return Query(self, cursor, args, kwargs, prepare_params)
+    def __call__(
+        self, cursor, *args, prepare_params=None, stream=None, **kwargs
+    ):
+        return Query(self, cursor, args, kwargs, prepare_params, stream=stream)
 
     def __str__(self):
         return self.content
@@ -50,28 +156,84 @@ class Script(object):
             params.extend(payload)
 
         if self.is_template:
-            try:
-                lookup = TemplateLookup(directories=self.sqldirs)
-                return (
-                    Template(self.content, lookup=lookup).render(**params),
-                    params,
-                )
-            except TypeError as e:
-                raise ImportError(
-                    "To use templates you need to install Mako"
-                ) from e
+            return self.template.render(**params), params
         return self.content, params
 
-    def execute(self, cursor, args, kwargs, prepare_params=None):
+    @property
+    def template(self):
+        """The compiled Mako template of this script.
+
+        It is compiled on first access and reused afterwards. Scripts
+        with the same content share the compiled template.
+        """
+        if Template is None:
+            raise ImportError("To use templates you need to install Mako")
+        if self._template is None:
+            lookup = self.lookup
+            if lookup is None:
+                lookup = get_lookup(
+                    sqldirs_key(self.sqldirs),
+                    filesystem_checks=not self.cache,
+                    module_dir=self.module_dir,
+                )
+            self._template = compile_template(
+                self.content, lookup, module_dir=self.module_dir
+            )
+        return self._template
+
+    def execute(self, cursor, args, kwargs, prepare_params=None, rewrite=None):
         if args:
             content, params = self._prepare(cursor, args, prepare_params)
         else:
             content, params = self._prepare(cursor, kwargs, prepare_params)
+        if rewrite is not None:
+            content = rewrite(content)
         try:
-            cursor.execute(content, params)
+            if self.is_template:
+                # Rendered templates are rarely executed twice
+                cursor.execute(content, params)
+            else:
+                cursor.execute_script(content, params)
         finally:
             self.echo and self.mogrify(cursor, content, params)
 
+    def many(self, cursor, rows, prepare_params=None, chunk_size=CHUNK_SIZE):
+        """Execute the script once for each item of ``rows`` using
+        the ``executemany`` method of the driver.
+
+        The parameters of each row are prepared like those of a single
+        call. Consecutive rows which result in the same statement, which
+        is always the case for non-template scripts, are passed to the
+        driver in chunks of at most ``chunk_size`` rows. The rows are
+        executed in the transaction of ``cursor``.
+
+        :param rows: An iterable of sequences or dicts holding the
+            parameters of each execution.
+        :return: The number of executed rows.
+        """
+        count = 0
+        batch, batch_content = [], None
+        for row in rows:
+            payload = row if isinstance(row, dict) else list(row)
+            content, params = self._prepare(cursor, payload, prepare_params)
+            if batch and (
+                content != batch_content or len(batch) >= chunk_size
+            ):
+                self._executemany(cursor, batch_content, batch)
+                batch = []
+            batch_content = content
+            batch.append(params)
+            count += 1
+        if batch:
+            self._executemany(cursor, batch_content, batch)
+        return count
+
+    def _executemany(self, cursor, content, params):
+        try:
+            cursor.executemany(content, params)
+        finally:
+            self.echo and self.mogrify(cursor, content, params[0])
+
 
 class CursorScript(object):
     def __init__(self, script, cursor):
@@ -81,5 +243,8 @@ class CursorScript(object):
     def __call__(self, *args, **kwargs):
         return self.script(self.cursor, *args, **kwargs)
 
+    def many(self, rows, **kwargs):
+        return self.script.many(self.cursor, rows, **kwargs)
+
     def __str__(self):
         return self.script.content
@@ -1,4 +1,5 @@
 import pathlib
+import shutil
 from types import SimpleNamespace
 
 import pytest
@@ -34,6 +35,17 @@ def qmark_shadow_sqldirs():
     ]
 
 
+@pytest.fixture
+def tmp_sqldirs(tmp_path, qmark_shadow_sqldirs):
+    """Writable copies of the shadowing qmark sqldirs"""
+    sqldirs = []
+    for sqldir in qmark_shadow_sqldirs:
+        sqldir = pathlib.Path(sqldir)
+        shutil.copytree(sqldir, tmp_path / sqldir.name)
+        sqldirs.append(tmp_path / sqldir.name)
+    return sqldirs
+
+
 @pytest.fixture
 def db(qmark_sqldirs):
     db = Database(
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from .. import exc
+from ..aio import AsyncDatabase
+from . import util
+
+
+@pytest.fixture
+def adb(qmark_sqldirs):
+    db = AsyncDatabase(
+        util.SQLITE_MEMORY,
+        qmark_sqldirs,
+        persist=True,
+        changeling=True,
+    )
+    asyncio.run(db.execute(util.CREATE_USERS))
+    asyncio.run(db.execute(util.INSERT_USERS))
+    return db
+
+
+def test_async_query(adb):
+    async def run():
+        async with adb.cursor as cur:
+            user = await cur.users.by_name(name="User 1").one()
+            assert user.email == "user.1@example.com"
+            assert len(await cur.users.all().all()) == 7
+            assert await cur.users.all().count() == 7
+            assert (await cur.users.by_name(name="Nobody").first()) is None
+            with pytest.raises(exc.DoesNotExistError):
+                await cur.users.by_name(name="Nobody").one()
+            names = [user.name async for user in cur.users.all()]
+            assert names[:2] == ["User 1", "User 2"]
+            rows = [row async for row in cur.users.all(stream=2)]
+            assert len(rows) == 7
+            rows = [row async for row in cur.users.all().unbunch(3)]
+            assert len(rows) == 7
+            many = cur.users.all().many()
+            assert len(await many.get(4)) == 4
+            assert len(await many.get(4)) == 3
+            query = cur.query("SELECT count(*) AS c FROM users")
+            assert await query.value() == 7
+            # Root scripts and custom methods
+            assert len(await cur.get_users().all()) == 7
+            assert await cur.get_test() == "Test"
+            assert await cur.users.get_test() == "Test"
+
+    asyncio.run(run())
+
+
+def test_async_cursor(adb):
+    async def run():
+        cur = await adb.cursor()
+        await cur.users.add(
+            name="User 8", email="user.8@example.com", city="City D"
+        ).run()
+        await cur.commit()
+        await cur.execute("SELECT count(*) FROM users")
+        assert (await cur.fetchone())[0] == 8
+        await cur.put()
+        count = await adb.executemany(
+            "INSERT INTO users (id, name, email, city) VALUES (?, ?, ?, ?)",
+            [(9, "User 9", "", ""), (10, "User 10", "", "")],
+        )
+        assert count == 2
+        async with adb(autocommit=True).cursor as cur:
+            assert await cur.users.all().count() == 10
+        await adb.close()
+        assert adb.db.conn is None
+
+    asyncio.run(run())
+
+
+def test_async_pool(qmark_sqldirs):
+    util.remove_db(util.SQLITE_FILE)
+    uri = "sqlite+pool:///{}".format(util.SQLITE_FILE)
+    db = AsyncDatabase(uri, qmark_sqldirs, size=2, overflow=1)
+    assert db.max_workers == 3
+
+    async def count(db):
+        async with db.cursor as cur:
+            return await cur.users.all().count()
+
+    async def run():
+        await db.execute(util.CREATE_USERS)
+        await db.execute(util.INSERT_USERS)
+        counts = await asyncio.gather(*[count(db) for _ in range(6)])
+        assert counts == [7] * 6
+        await db.close()
+
+    asyncio.run(run())
+    util.remove_db(util.SQLITE_FILE)
+    db = AsyncDatabase(uri, qmark_sqldirs, max_workers=2)
+    assert db.max_workers == 2
+
+
+def test_async_pool_execute_slots(qmark_sqldirs):
+    # execute and friends wait for a slot instead of blocking the only
+    # thread in Pool.get while an open cursor holds the connection.
+    util.remove_db(util.SQLITE_FILE)
+    uri = "sqlite+pool:///{}".format(util.SQLITE_FILE)
+    db = AsyncDatabase(uri, qmark_sqldirs, size=1, overflow=0, timeout=2)
+
+    async def run():
+        await db.execute(util.CREATE_USERS)
+        await db.execute(util.INSERT_USERS)
+        async with db.cursor as cur:
+            insert = asyncio.ensure_future(
+                db.executemany(
+                    "INSERT INTO users (id, name, email, city) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(8, "User 8", "", "")],
+                )
+            )
+            await asyncio.sleep(0.05)
+            assert not insert.done()
+            assert await asyncio.wait_for(cur.users.all().count(), 1) == 7
+        assert await asyncio.wait_for(insert, 1) == 1
+        await db.close()
+
+    asyncio.run(run())
@@ -1,6 +1,8 @@
 import queue
 import sqlite3
 import threading
+import time
+from collections import deque
 from unittest.mock import Mock
 
 import pytest
@@ -11,6 +13,10 @@ from .. import (
     connect,
     exc,
 )
+from ..metrics import (
+    Histogram,
+    PoolListener,
+)
 from . import util
 
 
@@ -42,6 +48,60 @@ def test_base_connection(pgdburl):
     assert c.close.call_count == 2
 
 
+def test_rewrite_queries():
+    cn = connect(util.SQLITE_MEMORY)
+    assert conn.plain_select(" SELECT 1;\n") == "SELECT 1"
+    assert conn.plain_select("-- comment\n/* a\nb */ select 1") is not None
+    for content in (
+        "INSERT INTO t VALUES (1);",
+        "SELECT 1; SELECT 2;",
+        "SELECT * FROM t FOR UPDATE;",
+        "SELECT * INTO t2 FROM t;",
+        "WITH x AS (DELETE FROM t RETURNING *) SELECT * FROM x;",
+    ):
+        assert conn.plain_select(content) is None
+        assert cn.limit_query(content, 1) is None
+        assert cn.exists_query(content) is None
+        assert cn.count_query(content) is None
+    assert conn.Connection.limit_query(cn, "SELECT 1 -- one", 2) == (
+        "SELECT * FROM (\nSELECT 1 -- one\n) AS quma_limit LIMIT 2"
+    )
+    # SQLite renames duplicate column names of derived tables
+    assert cn.limit_query("SELECT 1", 2) is None
+    assert cn.count_query("SELECT 1") == (
+        "SELECT count(*) FROM (\nSELECT 1\n) AS quma_count"
+    )
+    assert cn.exists_query("SELECT 1;") == (
+        "SELECT EXISTS (\nSELECT 1\n) AS quma_exists"
+    )
+
+
+def test_prepared_statements():
+    statements = conn.PreparedStatements(threshold=2, size=2)
+    assert statements.lookup("a") is None
+    assert not statements.hit("a")
+    assert statements.hit("a")
+    assert statements.evict() == []
+    statements.add("a", statements.new_name())
+    statements.add("b", statements.new_name())
+    assert statements.lookup("a") == "quma_1"
+    # "b" is the least recently used statement
+    assert statements.evict() == ["quma_2"]
+    assert list(statements.names) == ["a"]
+    statements.reject("c")
+    assert not statements.hit("c")
+    assert not statements.hit("c")
+
+    # Prepared statements are ignored by SQLite
+    db = Database(util.SQLITE_MEMORY, persist=True, prepare=1)
+    assert db.conn.prepare == 1
+    assert db.conn.prepare_size == 100
+    db.execute(util.CREATE_USERS)
+    with db.cursor as cur:
+        for _ in range(2):
+            assert cur.query("SELECT count(*) FROM users").value() == 0
+
+
 def test_failing_check():
     conn = connect(util.SQLITE_MEMORY, persist=True, pessimistic=True)
     connmock = Mock()
@@ -64,6 +124,49 @@ def test_persistent_pessimistic(dbpess):
         assert cn is not cursor.raw_conn
 
 
+def test_pessimistic_check_interval():
+    cn = connect(
+        util.SQLITE_MEMORY, persist=True, pessimistic=True, check_interval=60
+    )
+    raw = cn.get()
+    cn.put(raw)
+    cn._check = Mock()
+    cn._check.side_effect = exc.OperationalError
+    # Idle shorter than the interval, not checked
+    assert cn.get() is raw
+    assert cn._check.call_count == 0
+    cn.check_interval = 0
+    assert cn.get() is not raw
+    assert cn._check.call_count == 1
+
+
+def test_pool_check_interval():
+    util.remove_db(util.SQLITE_FILE)
+    uri = "sqlite+pool:///{}".format(util.SQLITE_FILE)
+    pool = connect(uri, size=1, pessimistic=True, check_interval=60)
+    c1 = pool.get()
+    pool.put(c1)
+    pool._conn.check = Mock()
+    c2 = pool.get()
+    assert c2 is c1
+    assert pool._conn.check.call_count == 0
+    assert (pool.checks, pool.failed_checks) == (0, 0)
+    pool.put(c2)
+    pool._conn.check_interval = 0
+    assert pool.get() is c1
+    assert (pool.checks, pool.failed_checks) == (1, 0)
+    pool.put(c1)
+    pool._conn.check.side_effect = exc.OperationalError
+    c2 = pool.get()
+    assert c2 is not c1
+    assert (pool.checks, pool.failed_checks) == (2, 1)
+    # Closed connections are detected without a check
+    pool.put(c2)
+    c2.close()
+    assert pool.get() is not c2
+    assert (pool.checks, pool.failed_checks) == (2, 2)
+
+
 def pool_overflow_counting(uri):
     conn = connect(uri, size=1, overflow=4)
     cn1 = conn.get()
@@ -364,3 +467,278 @@ def test_postgresql_failing_connection():
         connect(
             "postgresql://wrong_user_n4me:wrong_p4$$wrd@/wrng_db_n4me"
         ).get()
+
+
+def test_pool_recycle():
+    util.remove_db(util.SQLITE_FILE)
+    uri = "sqlite+pool:///{}".format(util.SQLITE_FILE)
+    pool = connect(uri, size=2, recycle=60)
+    c1 = pool.get()
+    pool.put(c1)
+    assert pool.get() is c1
+    pool.put(c1)
+    pool._created[id(c1)] -= 60
+    c2 = pool.get()
+    assert c2 is not c1
+    assert pool.overflow == -1
+    pool.put(c2)
+    pool.close()
+
+
+def test_pool_idle_timeout():
+    util.remove_db(util.SQLITE_FILE)
+    uri = "sqlite+pool:///{}".format(util.SQLITE_FILE)
+    pool = connect(uri, size=2, idle_timeout=60)
+    c1 = pool.get()
+    pool.put(c1)
+    assert pool.get() is c1
+    pool.put(c1)
+    conn, idle_since, autocommit = pool._pool.get()
+    pool._pool.put((conn, idle_since - 60, autocommit))
+    c2 = pool.get()
+    assert c2 is not c1
+    assert pool.overflow == -1
+    pool.put(c2)
+    pool.close()
+
+
+def test_pool_reap():
+    util.remove_db(util.SQLITE_FILE)
+    uri = "sqlite+pool:///{}".format(util.SQLITE_FILE)
+    pool = connect(uri, size=3, idle_timeout=60, min_idle=2)
+    assert pool._reaper is None
+    pool.reap()
+    assert (pool.checkedin, pool.overflow) == (2, -1)
+    c1 = pool.get()
+    c2 = pool.get()
+    c3 = pool.get()
+    pool.put(c1)
+    pool.put(c2)
+    pool.put(c3)
+    assert (pool.checkedin, pool.overflow) == (3, 0)
+    # Nothing expired, min_idle already reached
+    pool.reap()
+    assert (pool.checkedin, pool.overflow) == (3, 0)
+    with pool._pool.mutex:
+        pool._pool.queues[False] = deque(
+            (conn, idle_since - 60, False)
+            for conn, idle_since, _ in pool._pool.queues[False]
+        )
+    pool.reap()
+    assert (pool.checkedin, pool.overflow) == (2, -1)
+    assert not {c1, c2, c3} & {conn for conn, _, _ in pool._pool.items()}
+    pool.close()
+
+
+def test_pool_reaper_thread():
+    util.remove_db(util.SQLITE_FILE)
+    uri = "sqlite+pool:///{}".format(util.SQLITE_FILE)
+    with pytest.raises(ValueError):
+        connect(uri, min_idle=1, reap_interval=0.01)
+    pool = connect(
+        uri, size=2, min_idle=1, reap_interval=0.01, check_same_thread=False
+    )
+    reaper = pool._reaper
+    for _ in range(100):
+        if pool.checkedin:
+            break
+        time.sleep(0.01)
+    assert pool.checkedin == 1
+    pool.close()
+    assert pool._reaper is None
+    reaper.join(1)
+    assert not reaper.is_alive()
+
+
+class RollbackCounter(sqlite3.Connection):
+    rollbacks = 0
+
+    def rollback(self):
+        RollbackCounter.rollbacks += 1
+        super().rollback()
+
+
+def test_reset_clean_connection():
+    util.remove_db(util.SQLITE_FILE)
+    uri = "sqlite+pool:///{}".format(util.SQLITE_FILE)
+    pool = connect(uri, size=1, factory=RollbackCounter)
+    RollbackCounter.rollbacks = 0
+    c = pool.get(autocommit=True)
+    assert c.isolation_level is None
+    c.execute("CREATE TABLE t (a INT)")
+    pool.put(c)
+    assert RollbackCounter.rollbacks == 0
+    c = pool.get()
+    assert c.isolation_level == "DEFERRED"
+    c.execute("INSERT INTO t VALUES (1)")
+    c.commit()
+    c.execute("SELECT a FROM t").fetchall()
+    pool.put(c)
+    assert RollbackCounter.rollbacks == 0
+    c = pool.get()
+    c.execute("INSERT INTO t VALUES (2)")
+    assert c.in_transaction
+    pool.put(c)
+    assert RollbackCounter.rollbacks == 1
+    assert not c.in_transaction
+    c = pool.get()
+    assert c.execute("SELECT count(*) FROM t").fetchone()[0] == 1
+    pool.put(c)
+    pool.close()
+
+
+def test_pool_autocommit_partitions():
+    util.remove_db(util.SQLITE_FILE)
+    uri = "sqlite+pool:///{}".format(util.SQLITE_FILE)
+    pool = connect(uri, size=2)
+    c1 = pool.get(autocommit=True)
+    c2 = pool.get()
+    assert c1.isolation_level is None
+    assert c2.isolation_level == "DEFERRED"
+    pool.put(c1)
+    pool.put(c2)
+    # The connections keep their mode while idle
+    assert c1.isolation_level is None
+    assert pool.get() is c2
+    assert pool.get(autocommit=True) is c1
+    assert pool.mode_switches == 0
+    pool.put(c1)
+    # No transactional connection idle, c1 is switched
+    assert pool.get() is c1
+    assert c1.isolation_level == "DEFERRED"
+    assert pool.mode_switches == 1
+    pool.put(c1)
+    pool.put(c2)
+    assert pool.get(autocommit=True) in (c1, c2)
+    assert pool.mode_switches == 2
+    pool.close()
+
+
+def test_persistent_autocommit():
+    cn = connect(util.SQLITE_MEMORY, persist=True)
+    raw = cn.get(autocommit=True)
+    assert raw.isolation_level is None
+    cn.put(raw)
+    assert raw.isolation_level is None
+    assert cn.get() is raw
+    assert raw.isolation_level == "DEFERRED"
+    cn.put(raw)
+    cn.close()
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot["buckets"] == [(0.1, 2), (1.0, 1), (float("inf"), 1)]
+    assert snapshot["count"] == 4
+    assert snapshot["sum"] == pytest.approx(2.65)
+    assert snapshot["max"] == 2.0
+
+
+def test_pool_metrics():
+    class Listener(PoolListener):
+        def __init__(self):
+            self.events = []
+
+        def connect(self, pool, conn):
+            self.events.append("connect")
+
+        def checkout(self, pool, conn, wait):
+            self.events.append("checkout")
+
+        def checkin(self, pool, conn, hold):
+            self.events.append("checkin")
+
+        def timeout(self, pool, wait):
+            self.events.append("timeout")
+
+    util.remove_db(util.SQLITE_FILE)
+    uri = "sqlite+pool:///{}".format(util.SQLITE_FILE)
+    listener = Listener()
+    pool = connect(uri, size=1, overflow=1, timeout=0.01, listener=listener)
+    c1 = pool.get()
+    c2 = pool.get()
+    with pytest.raises(exc.TimeoutError):
+        pool.get()
+    pool.put(c1)
+    pool.put(c2)
+    assert listener.events == [
+        "connect",
+        "checkout",
+        "connect",
+        "checkout",
+        "timeout",
+        "checkin",
+        "checkin",
+    ]
+    stats = pool.stats()
+    assert stats["checkouts"] == 2
+    assert stats["checkins"] == 2
+    assert stats["timeouts"] == 1
+    assert (stats["connects"], stats["closes"]) == (2, 1)
+    assert (stats["max_checkedout"], stats["max_overflow"]) == (2, 1)
+    assert (stats["checkedin"], stats["checkedout"]) == (1, 0)
+    assert stats["wait_time"]["count"] == 3
+    assert stats["wait_time"]["max"] >= 0.01
+    assert stats["hold_time"]["count"] == 2
+    assert stats["connects_per_second"] > 0
+    pool.metrics.reset()
+    assert pool.stats()["checkouts"] == 0
+    pool.close()
+    assert pool.metrics.closes == 1
+
+
+def test_pool_failing_listener(caplog):
+    class Listener(PoolListener):
+        def checkout(self, pool, conn, wait):
+            raise ValueError("checkout")
+
+        def checkin(self, pool, conn, hold):
+            raise ValueError("checkin")
+
+    util.remove_db(util.SQLITE_FILE)
+    uri = "sqlite+pool:///{}".format(util.SQLITE_FILE)
+    pool = connect(uri, size=1, overflow=0, timeout=0.01, listener=Listener())
+    c1 = pool.get()
+    pool.put(c1)
+    # The connection has been returned and can be checked out again
+    assert pool.checkedin == 1
+    assert pool.get() is c1
+    pool.put(c1)
+    assert pool.metrics.checkouts == 2
+    assert pool.metrics.checkins == 2
+    assert "Pool listener" in caplog.text
+    assert "checkin" in caplog.text
+    pool.close()
+
+
+def test_pool_close_waits_for_reaper(caplog):
+    util.remove_db(util.SQLITE_FILE)
+    uri = "sqlite+pool:///{}".format(util.SQLITE_FILE)
+    pool = connect(
+        uri, size=2, min_idle=2, reap_interval=0.01, check_same_thread=False
+    )
+    connect_conn = pool._conn.get
+    reaping = threading.Event()
+
+    def slow_get(autocommit=False):
+        reaping.set()
+        time.sleep(0.1)
+        return connect_conn(autocommit=autocommit)
+
+    pool._conn.get = slow_get
+    assert reaping.wait(1)
+    reaper = pool._reaper
+    pool.close()
+    assert not reaper.is_alive()
+    # Nothing was requeued after the pool was drained
+    assert pool.checkedin == 0
+
+    # Errors of the reaper are logged
+    pool = connect(uri, size=2, min_idle=1)
+    pool._conn.get = Mock(side_effect=exc.ConnectionError("down"))
+    pool.reap()
+    assert pool.overflow == -2
+    assert "Failed to open an idle connection" in caplog.text
@@ -1,6 +1,10 @@
+import pickle
+import shutil
 import sqlite3
 import sys
 import threading
+import time
+from functools import partial
 from unittest import mock
 
 import pytest
@@ -8,9 +12,14 @@ import pytest
 from .. import (
     Database,
     Namespace,
+    batch,
+    bundle,
     database,
+    exc,
     query,
+    rows,
     script,
+    watch,
 )
 from .. import cursor as cursor_
 from . import util
@@ -430,7 +439,7 @@ def test_rollback(dbfile):
     rollback(dbfile)
 
 
-def test_overwrite_script_class(pyformat_sqldirs):
+def test_overwrite_script_class(pyformat_sqldirs, tmp_path):
     class MyScript(script.Script):
         def the_test(self):
             return "Test"
@@ -440,6 +449,24 @@ def test_overwrite_script_class(pyformat_sqldirs):
     )
     assert db.user.all.the_test() == "Test"
 
+    # Factories with the original signature
+    def factory(content, echo, is_template, sqldirs, prepare_params=None):
+        return MyScript(content, echo, is_template, sqldirs, prepare_params)
+
+    (tmp_path / "users").mkdir()
+    (tmp_path / "users" / "one.msql").write_text("SELECT 1 AS one;")
+    for cache in (False, True):
+        db = Database(
+            util.SQLITE_MEMORY,
+            [pyformat_sqldirs, tmp_path],
+            script_factory=factory,
+            cache=cache,
+        )
+        assert db.user.all.the_test() == "Test"
+        assert db.users.one.is_template
+        with db.cursor as cursor:
+            assert cursor.users.one().value() == 1
+
 
 def changeling_cursor(db):
     with db.cursor as cursor:
@@ -484,6 +511,59 @@ def test_no_changeling_cursor(db_no_changeling):
     )
 
 
+def compact_rows(db):
+    with db.cursor as cursor:
+        user = cursor.user.by_name(name="User 3").one()
+        assert user[0] == "user.3@example.com"
+        assert user["email"] == "user.3@example.com"
+        assert user.email == "user.3@example.com"
+        assert user.get("wrong") is None
+        assert "email" in user._fields
+        with pytest.raises(AttributeError):
+            user.wrong_attr
+        with pytest.raises(AttributeError):
+            user.email = "test@example.com"
+        users = cursor.users.all().all()
+        assert type(users[0]) is type(users[6])
+        assert [user.name for user in users][:2] == ["User 1", "User 2"]
+        assert cursor.users.all().first().name == "User 1"
+        assert len([user.id for user in cursor.users.all(stream=2)]) == 7
+        cursor.rollback()
+
+
+def test_compact_rows(qmark_sqldirs):
+    db = Database(
+        util.SQLITE_MEMORY, qmark_sqldirs, persist=True, compact_rows=True
+    )
+    db.execute(util.CREATE_USERS)
+    db.execute(util.INSERT_USERS)
+    compact_rows(db)
+    with db.cursor as cursor:
+        user = cursor.user.by_name(name="User 1").one()
+        # Members shadowed by columns are prefixed with an underscore
+        assert user.keys == "the keys"
+        assert user._keys() == ["email", "city", "keys"]
+        assert user == ("user.1@example.com", "City A", "the keys")
+
+    cls = rows.row_class(("a", "b", "a", "_c", "count"))
+    assert cls is rows.row_class(("a", "b", "a", "_c", "count"))
+    row = cls((1, 2, 3, 4, 5))
+    assert (row.a, row["a"], row._c, row["_c"], row[1:3]) == (
+        1,
+        3,
+        4,
+        4,
+        (2, 3),
+    )
+    assert (row.count, row._count(1)) == (5, 1)
+    assert repr(row) == "Row(a=1, b=2, a=3, _c=4, count=5)"
+    assert row._asdict() == {"a": 3, "b": 2, "_c": 4, "count": 5}
+    assert pickle.loads(pickle.dumps(row)) == row
+    description = (("x", None), ("y", None))
+    assert rows.description_class(description)._fields == ("x", "y")
+    assert rows.description_class(description) is rows.row_class(("x", "y"))
+
+
 def test_pypy_changeling_init(qmark_sqldirs):
     with mock.patch("quma.provider.sqlite.PLATFORM", "PyPy"):
         db = Database(
@@ -529,6 +609,57 @@ def test_template_script(db):
         script.Template = tmpl
 
 
+def test_template_cache(db, dbcache):
+    script.compile_template.cache_clear()
+    with dbcache.cursor as cursor:
+        for name in ("User 1", "User 2", "User 1"):
+            cursor.user.by_name_tmpl(name=name).one()
+        tmpl = dbcache.user.by_name_tmpl.template
+        assert tmpl is dbcache.user.by_name_tmpl.template
+        assert tmpl.lookup.filesystem_checks is False
+    assert script.compile_template.cache_info().misses == 1
+
+    with db.cursor as cursor:
+        for name in ("User 1", "User 2"):
+            cursor.user.by_name_tmpl(name=name).one()
+        # Scripts are re-read but the compiled template is shared
+        assert db.user.by_name_tmpl is not db.user.by_name_tmpl
+        tmpl = db.user.by_name_tmpl.template
+        assert tmpl is db.user.by_name_tmpl.template
+        assert tmpl.lookup.filesystem_checks is True
+    assert script.compile_template.cache_info().misses == 2
+
+
+def test_template_module_dir(qmark_sqldirs, tmp_path):
+    from mako.template import ModuleTemplate
+
+    def render(compiled_type):
+        db = Database(
+            util.SQLITE_MEMORY,
+            qmark_sqldirs,
+            persist=True,
+            changeling=True,
+            cache=True,
+            tmpl_module_dir=str(tmp_path),
+        )
+        db.execute(util.CREATE_USERS)
+        db.execute(util.INSERT_USERS)
+        with db.cursor as cursor:
+            user = cursor.user.by_name_tmpl(name="User 1").one()
+            assert user.intro == "I'm User 1"
+        assert type(db.user.by_name_tmpl.template) is compiled_type
+
+    script.compile_template.cache_clear()
+    render(script.Template)
+    modules = list(tmp_path.glob("quma_*.py"))
+    assert len(modules) == 1
+    assert (tmp_path / "users" / "include" / "macros.msql.py").is_file()
+
+    script.compile_template.cache_clear()
+    render(ModuleTemplate)
+    assert list(tmp_path.glob("quma_*.py")) == modules
+
+
 def test_dict_callback(dbdictcb, carrier):
     db = dbdictcb
 
@@ -615,6 +746,50 @@ def test_count(db):
     count(db)
 
 
+def count_once(db):
+    with db.cursor as cursor:
+        query = cursor.users.all()
+        query.script = mock.Mock(wraps=query.script)
+        assert len(query) == 7
+        assert query.count() == 7
+        assert query.exists()
+        assert len(query.all()) == 7
+        assert query.count() == 7
+        assert query.script.execute.call_count == 1
+        query.run()
+        assert query.count() == 7
+        assert query.script.execute.call_count == 2
+
+        query = cursor.users.all()
+        assert query.count(server=True) == 7
+        assert query.count() == 7
+        assert len(query.all()) == 7
+        assert cursor.users.none().count(server=True) == 0
+        # Counts of fetched results are not queried again
+        query = cursor.users.all()
+        query.script = mock.Mock(wraps=query.script)
+        query.all()
+        assert query.count(server=True) == 7
+        assert query.script.execute.call_count == 1
+
+
+def test_count_once(db):
+    count_once(db)
+    with db.cursor as cursor:
+        query = cursor.users.all()
+        assert query.count(server=True) == 7
+        assert query._rewritten
+        query = cursor.users.all(stream=True)
+        assert query.count() == 7
+        assert query._result_cache is None
+        # Not rewritable statements are counted the usual way
+        query = cursor.user.remove(name="User 1")
+        query.count(server=True)
+        assert query._has_been_executed
+        assert not query._rewritten
+        cursor.rollback()
+
+
 def rowcount(db):
     cur = db.cursor()
     assert (
@@ -714,9 +889,75 @@ def query_cache(db):
         assert users._has_been_executed is True
         assert users._result_cache is None
         assert users.first() is not None
+        # first() only fetches the first row
+        assert users._result_cache is None
+        assert len(users._rows) == 1
+        assert len(users.all()) == 7
         assert users._result_cache is not None
 
 
+def fetch_rows(db):
+    with db.cursor as cursor:
+        users = cursor.users.all()
+        assert users.first()[1] == "User 1"
+        assert len(users._rows) == 1
+        with pytest.raises(db.MultipleRowsError):
+            users.one()
+        assert len(users._rows) == 2
+        assert users.exists()
+        assert users
+        assert [user[1] for user in users.all()][:3] == [
+            "User 1",
+            "User 2",
+            "User 3",
+        ]
+        assert len(users.all()) == 7
+        assert cursor.users.by_name(name="User 1").one()[0] == (
+            "user.1@example.com"
+        )
+        assert cursor.users.none().first() is None
+        assert not cursor.users.none().exists()
+        assert not cursor.users.none()
+
+
+def test_fetch_rows(db, qmark_sqldirs):
+    fetch_rows(db)
+    db = Database(
+        util.SQLITE_MEMORY, qmark_sqldirs, persist=True, rewrite=True
+    )
+    db.execute(util.CREATE_USERS)
+    db.execute(util.INSERT_USERS)
+    fetch_rows(db)
+    with db.cursor as cursor:
+        users = cursor.users.all()
+        assert users.first()[1] == "User 1"
+        # SQLite doesn't support LIMIT rewriting
+        assert not users._rewritten
+        with pytest.raises(db.MultipleRowsError):
+            users.one()
+        assert len(users.all()) == 7
+        # Duplicate column names are kept
+        query = cursor.query(
+            "SELECT u.name, v.name FROM users u JOIN users v "
+            "ON u.id = v.id ORDER BY u.name"
+        )
+        assert query.first() == ("User 1", "User 1")
+        assert [d[0] for d in query.description] == ["name", "name"]
+        users = cursor.users.by_name(name="User 1")
+        assert users.exists()
+        assert users._rewritten
+        assert users.one()[0] == "user.1@example.com"
+        # The limit did not cut the result
+        assert users._complete
+        assert len(users.all()) == 1
+        assert not cursor.users.none().exists()
+        # Statements which are not a single SELECT are not rewritten
+        query = cursor.user.add(name="Test", email="t@example.com", city="C")
+        assert query.first() is None
+        assert not query._rewritten
+        cursor.rollback()
+
+
 def test_query_cache(db):
     query_cache(db)
 
@@ -761,6 +1002,179 @@ def test_many_default(dbfile):
     many_default(dbfile)
 
 
+def execute_many(db):
+    rows = [
+        {
+            "id": 100 + i,
+            "name": "Many {}".format(i),
+            "email": "many.{}@example.com".format(i),
+            "city": "Many City",
+        }
+        for i in range(30)
+    ]
+    with db.cursor as cursor:
+        cursor.executemany = mock.Mock(wraps=cursor.executemany)
+        assert cursor.user.add.many(rows[:25], chunk_size=10) == 25
+        assert cursor.executemany.call_count == 3
+        assert db.user.add.many(cursor, iter(rows[25:])) == 5
+        assert cursor.executemany.call_count == 4
+        assert len(cursor.users.by_city(city="Many City").all()) == 30
+        assert cursor.user.add.many([]) == 0
+        cursor.rollback()
+        assert len(cursor.users.by_city(city="Many City").all()) == 0
+
+
+def test_execute_many(db, tmp_path):
+    execute_many(db)
+
+    def prepare(carrier, params):
+        params["city"] = "Prepared City"
+        return params
+
+    with db.cursor as cursor:
+        rows = [{"name": "Prepared", "email": "prepared@example.com"}] * 3
+        assert cursor.user.add.many(rows, prepare_params=prepare) == 3
+        assert len(cursor.users.by_city(city="Prepared City").all()) == 3
+        cursor.rollback()
+
+    # Templates are batched as long as the rendered statement is the same
+    (tmp_path / "add.msql").write_text(
+        "INSERT INTO users (name, email, city) VALUES (:name, :email,\n"
+        "% if city:\n:city\n% else:\n'No City'\n% endif\n)"
+    )
+    tmpldb = Database(util.SQLITE_MEMORY, tmp_path, persist=True)
+    tmpldb.execute(util.CREATE_USERS)
+    rows = [
+        {"name": "a", "email": "a", "city": "A"},
+        {"name": "b", "email": "b", "city": "B"},
+        {"name": "c", "email": "c", "city": None},
+        {"name": "d", "email": "d", "city": "D"},
+    ]
+    with tmpldb.cursor as cursor:
+        cursor.executemany = mock.Mock(wraps=cursor.executemany)
+        assert cursor.add.many(rows) == 4
+        assert cursor.executemany.call_count == 3
+        assert cursor.query("SELECT city FROM users ORDER BY name").all() == [
+            ("A",),
+            ("B",),
+            ("No City",),
+            ("D",),
+        ]
+
+    assert (
+        tmpldb.executemany(
+            "INSERT INTO users (name, email, city) VALUES (?, ?, ?)",
+            ((str(i), str(i), "Raw City") for i in range(5)),
+            chunk_size=2,
+        )
+        == 5
+    )
+    assert tmpldb.execute(
+        "SELECT count(*) FROM users WHERE city = 'Raw City'"
+    ) == [(5,)]
+    with pytest.raises(sqlite3.OperationalError):
+        tmpldb.executemany("INSERT INTO nope VALUES (?)", [(1,)])
+
+
+def test_batch_insert(db):
+    assert batch.split_insert("INSERT INTO t VALUES (:a, ':b', :a);") == (
+        "INSERT INTO t VALUES ",
+        "(?, ':b', ?)",
+        "",
+        2,
+        ("a", "a"),
+    )
+    for content in (
+        "INSERT INTO t SELECT * FROM s",
+        "INSERT INTO t VALUES (1)",
+        "INSERT INTO t VALUES (?), (?)",
+        "INSERT INTO t VALUES (?, :a)",
+        "INSERT INTO t VALUES (?1, ?2)",
+        "INSERT INTO t VALUES (?) ON CONFLICT (a) DO UPDATE SET b = ?",
+        "INSERT INTO t VALUES (?); DELETE FROM t",
+        "UPDATE t SET a = ?",
+    ):
+        assert batch.split_insert(content) is None
+    assert batch.multi_insert("INSERT INTO t VALUES (?, 1);", 3) == (
+        "INSERT INTO t VALUES (?, 1),\n(?, 1),\n(?, 1)"
+    )
+
+    named = (
+        "INSERT INTO users (id, name, email, city) VALUES (:id, :n, '', :c)"
+    )
+    with db.cursor as cursor:
+        raw = mock.Mock(wraps=cursor.raw_cursor.cursor)
+        rows = [{"id": i, "n": str(i), "c": "Batch"} for i in range(8, 19)]
+        batch.executemany(raw, named, rows, 9)
+        # 3 variables per row, i. e. 3 rows per statement
+        assert raw.execute.call_count == 4
+        assert raw.executemany.call_count == 0
+        qmark = "INSERT INTO users VALUES (?, ?, 'batch@example.com', ?)"
+        rows = [(i, str(i), "Batch") for i in range(20, 30)]
+        batch.executemany(raw, qmark, rows, 999)
+        assert raw.execute.call_count == 5
+        batch.executemany(raw, "DELETE FROM users WHERE id = ?", [(29,)], 9)
+        assert raw.executemany.call_count == 1
+        users = cursor.users.by_city(city="Batch").all()
+        ids = list(range(8, 19)) + list(range(20, 29))
+        assert sorted(user.name for user in users) == sorted(map(str, ids))
+
+
+def test_copy_unsupported(db):
+    with pytest.raises(exc.APIError):
+        db.copy("users", [(8, "User 8", "user.8@example.com", "City")])
+
+
+def gather(db):
+    users, user, count = db.gather(
+        db.users.all,
+        partial(db.users.by_name, name="User 2"),
+        lambda cur: cur.users.all().count(),
+    )
+    assert len(users) == 7
+    assert user[0].email == "user.2@example.com"
+    assert count == 7
+    with pytest.raises(AttributeError):
+        db.gather(db.users.all, lambda cur: cur.unknown)
+    assert db.gather() == []
+
+
+def test_gather(db, qmark_sqldirs):
+    # Persistent connection, the calls are run one after another
+    gather(db)
+    assert db._executor is None
+    util.remove_db(util.SQLITE_FILE)
+    pooldb = Database(
+        "sqlite+pool:///{}".format(util.SQLITE_FILE),
+        qmark_sqldirs,
+        changeling=True,
+        check_same_thread=False,
+        size=2,
+    )
+    pooldb.execute(util.CREATE_USERS)
+    pooldb.execute(util.INSERT_USERS)
+    checkedout = pooldb.conn.checkedout
+    gather(pooldb)
+    assert pooldb._executor._max_workers == 12
+    # All connections have been returned
+    assert pooldb.conn.checkedout == checkedout
+    pooldb.close()
+    assert pooldb._executor is None
+
+    # Connections bound to their thread are used one after another
+    pooldb = Database(
+        "sqlite+pool:///{}".format(util.SQLITE_FILE),
+        qmark_sqldirs,
+        changeling=True,
+        size=2,
+    )
+    gather(pooldb)
+    assert pooldb._executor is None
+    with pooldb.cursor as cur:
+        assert len(cur.users.all()) == 7
+    pooldb.close()
+
+
 def test_generator(db):
     def users_generator():
         with db.cursor as cur:
@@ -786,6 +1200,55 @@ def test_unbunch(db):
     unbunch(db)
 
 
+def stream(db):
+    with db.cursor as cur:
+        query = cur.users.all(stream=2)
+        assert [user.name for user in query][:2] == ["User 1", "User 2"]
+        assert query._result_cache is None
+        # Streaming again executes the query again
+        assert len(list(query)) == 7
+        assert len(list(cur.users.all(stream=True))) == 7
+        # Fetched results are reused
+        query = cur.users.all(stream=True)
+        assert len(query.all()) == 7
+        assert sum(1 for _ in query) == 7
+        assert query._result_cache is not None
+        assert len(list(cur.query("SELECT * FROM users;", stream=3))) == 7
+
+
+def test_stream(db, qmark_sqldirs):
+    stream(db)
+    db = Database(util.SQLITE_MEMORY, qmark_sqldirs, persist=True, stream=3)
+    db.execute(util.CREATE_USERS)
+    db.execute(util.INSERT_USERS)
+    with db.cursor as cur:
+        query = cur.users.all()
+        assert query.stream == 3
+        assert len(query) == 7
+        assert sum(1 for _ in query) == 7
+        assert query._result_cache is None
+        assert cur.users.all(stream=False).stream is False
+
+
+def stream_batches(db):
+    with db.cursor as cur:
+        query = cur.users.all(stream=2)
+        assert len(list(query.unbunch(3))) == 7
+        many = cur.users.all(stream=2).many()
+        assert len(many.get(4)) == 4
+        assert len(many.get(4)) == 3
+        assert many.get(4) == []
+        assert sum(1 for _ in cur.users.all(stream=2)) == 7
+
+
+def test_stream_batches(db):
+    stream_batches(db)
+    with db.cursor as cur:
+        # SQLite does not support server side cursors
+        assert cur.stream_cursor(10) is None
+        assert cur._streams == []
+
+
 def test_shadowing(db, dbshadow):
     with db.cursor as cursor:
         assert len(dbshadow.get_users(cursor)) == 7
@@ -839,6 +1302,438 @@ def test_caching(db, dbcache):
         assert len(cursor.user._scripts) >= 0
 
 
+def test_no_cache_new_files(tmp_path):
+    # Without cache and reload_interval new and removed files are found
+    (tmp_path / "users").mkdir()
+    (tmp_path / "users" / "a.sql").write_text("SELECT 'a';")
+    db = Database(util.SQLITE_MEMORY, tmp_path)
+    assert db.users.a.content == "SELECT 'a';"
+    (tmp_path / "users" / "b.sql").write_text("SELECT 'b';")
+    assert db.users.b.content == "SELECT 'b';"
+    (tmp_path / "users" / "b.sql").unlink()
+    with pytest.raises(AttributeError):
+        db.users.b
+
+
+def test_reload_interval(qmark_sqldirs, tmp_path):
+    import shutil
+
+    sqldir = tmp_path / "scripts"
+    shutil.copytree(qmark_sqldirs, sqldir)
+    db = Database(util.SQLITE_MEMORY, sqldir, persist=True, reload_interval=0)
+    db.execute(util.CREATE_USERS)
+    db.execute(util.INSERT_USERS)
+    script = db.users.all
+    assert db.users.all is script
+    with db.cursor as cursor:
+        assert len(cursor.users.all()) == 7
+
+    (sqldir / "users" / "all.sql").write_text(
+        "SELECT id, name FROM users WHERE id < 3;"
+    )
+    assert db.users.all is not script
+    with db.cursor as cursor:
+        assert len(cursor.users.all()) == 2
+
+    with pytest.raises(AttributeError):
+        db.users.new_script
+    (sqldir / "users" / "new_script.sql").write_text("SELECT 1;")
+    assert str(db.users.new_script) == "SELECT 1;"
+    (sqldir / "users" / "new_script.sql").unlink()
+    with pytest.raises(AttributeError):
+        db.users.new_script
+
+    db.reload_interval = db.users.reload_interval = 3600
+    script = db.users.all
+    (sqldir / "users" / "all.sql").write_text("SELECT 1;")
+    assert db.users.all is script
+
+
+def test_cache_shadowing(qmark_shadow_sqldirs):
+    db = Database(
+        util.SQLITE_MEMORY,
+        qmark_shadow_sqldirs,
+        persist=True,
+        changeling=True,
+        cache=True,
+    )
+    with db.cursor as cursor:
+        assert cursor.get_city().one().name == "Masking City"
+        assert cursor.addresses.by_zip().one().address == "Masking Address"
+        assert cursor.addresses.by_user().one().address == "Shadowed Address"
+
+
+def test_dir_index(tmp_sqldirs):
+    from ..namespace import DirIndex
+
+    shadowed, masking = tmp_sqldirs
+    index = DirIndex(shadowed / "users", "sql", "msql")
+    assert index.has_init
+    assert index.dirs == [shadowed / "users" / "include"]
+    assert index.scripts["all"] == shadowed / "users" / "all.sql"
+    assert index.scripts["by_name_tmpl"].suffix == ".msql"
+    assert "macros" not in index.scripts
+
+    # sql files win over templates with the same name
+    (shadowed / "users" / "all.msql").write_text("SELECT 1;")
+    index = DirIndex(shadowed / "users", "sql", "msql")
+    assert index.scripts["all"] == shadowed / "users" / "all.sql"
+    index = DirIndex(masking, "sql", "msql")
+    assert index.dirs == [masking / "addresses"]
+    assert set(index.scripts) == {"get_city", "get_trees"}
+
+    db = Database(util.SQLITE_MEMORY, tmp_sqldirs, persist=True)
+    assert db.namespaces["__root__"]._index.path == masking
+    assert db.namespaces["users"]._index is db.namespaces["user"]._index
+    # Lookups use the index, misses rescan the directory. Changes to
+    # existing files are visible immediately.
+    (masking / "get_city.sql").write_text("SELECT 'Changed' AS name;")
+    (masking / "get_new.sql").write_text("SELECT 1;")
+    assert str(db.get_city) == "SELECT 'Changed' AS name;"
+    assert str(db.get_new) == "SELECT 1;"
+
+
+def test_lazy_namespaces(qmark_shadow_sqldirs):
+    db = Database(util.SQLITE_MEMORY, qmark_shadow_sqldirs, persist=True)
+    assert dict.keys(db.namespaces) == set()
+    assert db.import_times == {}
+    assert "users" in db.namespaces
+    assert dict.keys(db.namespaces) == set()
+
+    # Directories with a module may declare aliases and are loaded
+    # first, plain directories stay pending.
+    assert type(db.users).__name__ == "Users"
+    assert dict.keys(db.namespaces) == {"users", "user", "__root__", "root"}
+    assert set(db.import_times) == {"users", "__root__"}
+    assert str(db.get_city) == "SELECT 'Masking City' AS name;\n"
+    assert dict.keys(db.namespaces) == {"users", "user", "__root__", "root"}
+    # Unknown names may be aliases and load all namespaces
+    with pytest.raises(AttributeError):
+        db.unknown
+    assert dict.keys(db.namespaces) == {
+        "users",
+        "user",
+        "__root__",
+        "root",
+        "addresses",
+    }
+    with pytest.raises(KeyError):
+        db.namespaces["unknown"]
+
+    db = Database(util.SQLITE_MEMORY, qmark_shadow_sqldirs, eager=True)
+    assert set(dict.keys(db.namespaces)) == {
+        "users",
+        "user",
+        "__root__",
+        "root",
+        "addresses",
+    }
+    assert set(db.import_times) == {"__root__", "users", "addresses"}
+    assert all(t > 0 for t in db.import_times.values())
+
+    db = Database(util.SQLITE_MEMORY, qmark_shadow_sqldirs)
+    assert "user" in db.namespaces
+    db = Database(util.SQLITE_MEMORY, qmark_shadow_sqldirs)
+    assert db.namespaces["user"] is db.namespaces["user"]
+
+
+def test_lazy_alias_shadowing(tmp_path):
+    # An alias of a later sqldir masks a plain directory even if the
+    # alias is accessed first.
+    plain, masking = tmp_path / "plain", tmp_path / "masking"
+    (plain / "user").mkdir(parents=True)
+    (plain / "user" / "x.sql").write_text("SELECT 'plain';")
+    (masking / "users").mkdir(parents=True)
+    (masking / "users" / "x.sql").write_text("SELECT 'masking';")
+    (masking / "users" / "__init__.py").write_text(
+        "from quma import Namespace\n\n\n"
+        "class Users(Namespace):\n"
+        "    alias = 'user'\n"
+    )
+    for eager in (False, True):
+        db = Database(util.SQLITE_MEMORY, [plain, masking], eager=eager)
+        assert db.user.x.content == "SELECT 'masking';"
+        db.users
+        assert db.user.x.content == "SELECT 'masking';"
+
+
+def test_lazy_namespaces_threaded(tmp_path):
+    # The masking namespace loads slowly. Concurrent lookups must wait
+    # for the complete shadow chain.
+    shadowed, masking = tmp_path / "shadowed", tmp_path / "masking"
+    started = tmp_path / "started"
+    for sqldir, name in ((shadowed, "shadowed"), (masking, "masking")):
+        (sqldir / "users").mkdir(parents=True)
+        (sqldir / "users" / "who.sql").write_text(
+            "SELECT '{}' AS who;".format(name)
+        )
+    (masking / "users" / "__init__.py").write_text(
+        "import pathlib, time\n"
+        "pathlib.Path({!r}).touch()\n"
+        "time.sleep(0.3)\n".format(str(started))
+    )
+    db = Database(util.SQLITE_MEMORY, [shadowed, masking])
+    results = []
+    loader = threading.Thread(target=lambda: results.append(db.users.who))
+    loader.start()
+    for _ in range(100):
+        if started.exists():
+            break
+        time.sleep(0.01)
+    assert "masking" in db.users.who.content
+    loader.join()
+    assert "masking" in results[0].content
+
+
+def test_resolution_cache(qmark_sqldirs, tmp_sqldirs):
+    db = Database(util.SQLITE_MEMORY, qmark_sqldirs, cache=True, eager=True)
+    users = db.users
+    assert db.namespaces.resolved["users"] is users
+    assert db.users is users
+    assert db.get_test is db.get_test
+    with db.cursor as cursor:
+        bound = cursor.users
+        assert cursor.users is bound
+        assert cursor.users.all is bound.all
+        assert cursor.get_test is cursor.get_test
+        assert cursor.fetchall is not None
+        assert "fetchall" not in cursor._bound
+
+    # Root scripts are read on each access if the cache is disabled
+    db = Database(util.SQLITE_MEMORY, qmark_sqldirs)
+    assert db.users is db.users
+    assert "get_users" not in db.namespaces.resolved
+    with db.cursor as cursor:
+        assert cursor.users is cursor.users
+        assert cursor.users.all is not cursor.users.all
+        assert cursor.get_users is not cursor.get_users
+
+    # Reloads invalidate the memoized names
+    shadowed, masking = tmp_sqldirs
+    db = Database(util.SQLITE_MEMORY, tmp_sqldirs, cache=True)
+    with db.cursor as cursor:
+        assert cursor.get_city().value() == "Masking City"
+        (masking / "get_city.sql").unlink()
+        db.reload(masking / "get_city.sql")
+        assert cursor.get_city().value() == "Shadowed City"
+        users = cursor.users
+        (masking / "users").mkdir()
+        (masking / "users" / "one.sql").write_text("SELECT 1;")
+        db.reload(masking / "users")
+        assert cursor.users is not users
+        assert cursor.users.one().value() == 1
+
+
+def test_reload(tmp_sqldirs):
+    shadowed, masking = tmp_sqldirs
+    db = Database(
+        util.SQLITE_MEMORY, tmp_sqldirs, persist=True, cache=True, eager=True
+    )
+    db.execute(util.CREATE_USERS)
+    db.execute(util.INSERT_USERS)
+    with db.cursor as cursor:
+        # Modified, new and removed scripts
+        (masking / "get_city.sql").write_text("SELECT 'Reloaded' AS name;")
+        (shadowed / "addresses" / "by_user.sql").unlink()
+        (masking / "users").mkdir()
+        (masking / "users" / "one.sql").write_text("SELECT 1;")
+        (shadowed / "users" / "two.sql").write_text("SELECT 2;")
+        assert cursor.get_city().one()[0] == "Masking City"
+        for path in (
+            masking / "get_city.sql",
+            shadowed / "addresses" / "by_user.sql",
+            masking / "users",
+            shadowed / "users" / "two.sql",
+            shadowed / "users" / "__pycache__",
+        ):
+            db.reload(path)
+        assert cursor.get_city().one()[0] == "Reloaded"
+        with pytest.raises(AttributeError):
+            db.addresses.by_user
+        assert db.users.one(cursor).value() == 1
+        assert db.users.two(cursor).value() == 2
+        assert db.user.two(cursor).value() == 2
+        assert db.user.get_test(cursor) == "Test"
+        assert len(db.users.all(cursor)) == 7
+
+        # Masking scripts are removed and the shadowed ones show up
+        (masking / "get_city.sql").unlink()
+        db.reload(masking / "get_city.sql")
+        assert cursor.get_city().one()[0] == "Shadowed City"
+
+        # A new namespace directory in the shadowed sqldir must
+        # not mask the namespace of the later sqldir.
+        (shadowed / "trees").mkdir()
+        (shadowed / "trees" / "oak.sql").write_text("SELECT 'Shadowed';")
+        (shadowed / "trees" / "pine.sql").write_text("SELECT 'Pine';")
+        (masking / "trees").mkdir()
+        (masking / "trees" / "oak.sql").write_text("SELECT 'Masking';")
+        db.reload(masking / "trees")
+        db.reload(shadowed / "trees")
+        assert cursor.trees.oak().value() == "Masking"
+        assert cursor.trees.pine().value() == "Pine"
+
+        # Removed namespace directories
+        shutil.rmtree(masking / "trees")
+        db.reload(masking / "trees")
+        assert cursor.trees.oak().value() == "Shadowed"
+        shutil.rmtree(shadowed / "trees")
+        db.reload(shadowed / "trees")
+        assert "trees" not in db.namespaces
+
+        # Changed namespace classes
+        (masking / "__init__.py").write_text(
+            "from quma import Namespace\n\n"
+            "class Root(Namespace):\n"
+            "    def get_test(self, cursor):\n"
+            "        return 'Reloaded Test'\n"
+        )
+        db.reload(masking / "__init__.py")
+        assert cursor.get_test() == "Reloaded Test"
+        assert cursor.get_trees().first()[0] == "Oak"
+
+
+def test_polling_watcher(tmp_sqldirs):
+    shadowed, masking = tmp_sqldirs
+    db = Database(util.SQLITE_MEMORY, tmp_sqldirs, persist=True, cache=True)
+    watcher = watch.PollingWatcher(db)
+    assert watcher.poll() == []
+    (masking / "get_city.sql").write_text("SELECT 'Reloaded' AS name;")
+    (shadowed / "trees").mkdir()
+    (shadowed / "trees" / "oak.sql").write_text("SELECT 'Oak';")
+    assert watcher.poll() == [
+        shadowed / "trees",
+        shadowed / "trees" / "oak.sql",
+        masking / "get_city.sql",
+    ]
+    (shadowed / "trees" / "oak.sql").unlink()
+    assert watcher.poll() == [shadowed / "trees" / "oak.sql"]
+    assert watcher.poll() == []
+
+
+def test_watcher_poll_error(tmp_sqldirs, caplog):
+    db = Database(util.SQLITE_MEMORY, tmp_sqldirs, persist=True, cache=True)
+    watcher = watch.PollingWatcher(db, interval=0.01)
+    polls = []
+
+    def poll():
+        polls.append(None)
+        if len(polls) == 1:
+            raise FileNotFoundError("removed")
+        return []
+
+    watcher.poll = poll
+    watcher.start()
+    timeout = time.monotonic() + 5
+    while len(polls) < 3:
+        assert time.monotonic() < timeout
+        time.sleep(0.01)
+    watcher.stop()
+    assert "Failed to poll" in caplog.text
+
+
+def watch_changes(sqldirs, method, name):
+    import time
+
+    def wait_for(predicate):
+        timeout = time.monotonic() + 5
+        while not predicate():
+            assert time.monotonic() < timeout
+            time.sleep(0.01)
+
+    shadowed, masking = sqldirs
+    db = Database(
+        util.SQLITE_MEMORY,
+        sqldirs,
+        persist=True,
+        cache=True,
+        watch=method,
+        watch_interval=0.01,
+    )
+    sql = "SELECT '{}' AS name;".format(name)
+    (masking / "get_city.sql").write_text(sql)
+    (shadowed / name).mkdir()
+    wait_for(lambda: str(db.get_city) == sql)
+    wait_for(lambda: name in db.namespaces)
+    watcher = db.watcher
+    db.close()
+    assert db.watcher is None
+    assert watcher._thread is None
+
+
+def test_watch(tmp_sqldirs):
+    with pytest.raises(ValueError) as e:
+        Database(util.SQLITE_MEMORY, tmp_sqldirs, watch=True)
+    assert str(e.value).startswith("Watching sqldirs requires")
+    with pytest.raises(ValueError) as e:
+        Database(util.SQLITE_MEMORY, tmp_sqldirs, cache=True, watch="wrong")
+    assert str(e.value).startswith("Watch method must be")
+
+    watch_changes(tmp_sqldirs, "poll", "polled")
+    if watch.get_libc() is not None:
+        watch_changes(tmp_sqldirs, "inotify", "notified")
+
+
+def test_bundle(tmp_sqldirs, tmp_path):
+    shadowed, masking = tmp_sqldirs
+    target = tmp_path / "scripts.qbundle"
+    bundle.build(tmp_sqldirs, target)
+    for sqldir in tmp_sqldirs:
+        shutil.rmtree(sqldir)
+
+    db = Database(
+        util.SQLITE_MEMORY,
+        bundle=target,
+        persist=True,
+        changeling=True,
+        cache=True,
+    )
+    db.execute(util.CREATE_USERS)
+    db.execute(util.INSERT_USERS)
+    assert db.sqldirs == [str(shadowed), str(masking)]
+    assert type(db.users).__module__ == "quma.mapping.users"
+    # Namespaces with a module are loaded first, as with sqldirs
+    assert dict.keys(db.namespaces) == {"users", "user", "__root__", "root"}
+    with db.cursor as cursor:
+        assert len(cursor.users.all()) == 7
+        assert cursor.user.get_test() == "Test"
+        assert cursor.get_test() == "Masking Test"
+        assert cursor.get_shadowed_test() == "Shadowed Test"
+        assert cursor.get_city().one().name == "Masking City"
+        assert len(cursor.get_trees()) == 2
+        assert cursor.addresses.by_zip().one().address == "Masking Address"
+        assert cursor.addresses.by_user().one().address == "Shadowed Address"
+        user = cursor.user.by_name_tmpl(name="User 1").one()
+        assert user.intro == "I'm User 1"
+        sql = (
+            '<%namespace name="m" file="users/include/macros.msql" />'
+            "SELECT city FROM users WHERE name = ${m.named_param()};"
+        )
+        user = cursor.query(sql, is_template=True, name="User 2").one()
+        assert user.city == "City A"
+
+    with pytest.raises(ValueError) as e:
+        Database(util.SQLITE_MEMORY, tmp_sqldirs, bundle=target)
+    assert str(e.value).startswith("Pass either sqldirs or a bundle")
+    with pytest.raises(ValueError) as e:
+        Database(util.SQLITE_MEMORY, bundle=target, reload_interval=1)
+    assert str(e.value).startswith("Bundles can't be reloaded")
+    target.write_bytes(b"QUMA" + target.read_bytes()[5:])
+    with pytest.raises(ValueError) as e:
+        Database(util.SQLITE_MEMORY, bundle=target)
+    assert "another version" in str(e.value)
+
+
+def test_bundle_cli(qmark_sqldirs, tmp_path):
+    target = tmp_path / "scripts.qbundle"
+    bundle.main([str(target), str(qmark_sqldirs), "--file-ext", "sql"])
+    db = Database(util.SQLITE_MEMORY, bundle=target, persist=True)
+    db.execute(util.CREATE_USERS)
+    db.execute(util.INSERT_USERS)
+    with db.cursor as cursor:
+        assert len(cursor.users.all()) == 7
+
+
 def test_close(db):
     from .. import provider
 
@@ -228,6 +228,101 @@ def test_unbunch(mydb, mypooldb):
         unbunch(db)
 
 
+@pytest.mark.mysql
+def test_count_once(mydb, mypooldb):
+    from .test_db import count_once
+
+    for db in (mydb, mypooldb):
+        count_once(db)
+
+
+@pytest.mark.mysql
+def test_fetch_rows(mydb, mypooldb):
+    from .test_db import fetch_rows
+
+    for db in (mydb, mypooldb):
+        fetch_rows(db)
+
+
+@pytest.mark.mysql
+def test_execute_many(mydb, mypooldb):
+    from .test_db import execute_many
+
+    for db in (mydb, mypooldb):
+        execute_many(db)
+
+
+@pytest.mark.mysql
+def test_gather(mydb, mypooldb):
+    from .test_db import gather
+
+    for db in (mydb, mypooldb):
+        gather(db)
+
+
+@pytest.mark.mysql
+def test_compact_rows(pyformat_sqldirs):
+    from .. import Database
+    from .test_db import compact_rows
+
+    for uri in (util.MYSQL_URI, util.MYSQL_POOL_URI):
+        db = Database(uri, pyformat_sqldirs, compact_rows=True)
+        compact_rows(db)
+        with db.cursor as cursor:
+            user = cursor.user.by_name(name="User 1").one()
+            assert (user.count, user.count2) == (13, 13)
+            assert user._count("City A") == 1
+
+
+@pytest.mark.mysql
+def test_stream(mydb, mypooldb):
+    from .test_db import stream
+
+    for db in (mydb, mypooldb):
+        stream(db)
+
+
+@pytest.mark.mysql
+def test_stream_cursor(mydb, mypooldb):
+    from MySQLdb.cursors import SSDictCursor
+
+    from .test_db import stream_batches
+
+    for db in (mydb, mypooldb):
+        stream_batches(db)
+        with db.cursor as cur:
+            query = cur.users.all(stream=2)
+            assert [user.name for user in query][:2] == ["User 1", "User 2"]
+            many = cur.users.all(stream=True).many()
+            assert len(many.get(2)) == 2
+            assert isinstance(many.cursor.raw_cursor.cursor, SSDictCursor)
+        # The unbuffered result has been drained when the cursor was put
+        with db.cursor as cur:
+            assert len(cur.users.all()) == 7
+
+
+@pytest.mark.mysql
+def test_reset(mypooldb):
+    pool = mypooldb.conn
+    conn = pool.get(autocommit=True)
+    conn.cursor().execute("SELECT 1")
+    assert not conn.quma_dirty
+    pool.put(conn)
+    assert conn.get_autocommit()
+    conn = pool.get()
+    assert not conn.get_autocommit()
+    conn.cursor().execute("SELECT 1")
+    assert conn.quma_dirty
+    pool.put(conn)
+    assert not conn.quma_dirty
+    conn = pool.get(autocommit=True)
+    conn.cursor().execute("START TRANSACTION")
+    assert conn.quma_dirty
+    pool.put(conn)
+    assert not conn.quma_dirty
+    mypooldb.close()
+
+
 @pytest.mark.mysql
 def test_execute(mydb, mypooldb_dict):
     from .test_db import execute
@@ -2,6 +2,7 @@ from unittest.mock import Mock
 
 import pytest
 
+from .. import Database
 from ..exc import FetchError
 from . import util
 
@@ -278,6 +279,129 @@ def test_unbunch(pgdb, pgpooldb):
         unbunch(db)
 
 
+@pytest.mark.postgres
+def test_count_once(pgdb, pgpooldb):
+    from .test_db import count_once
+
+    for db in (pgdb, pgpooldb):
+        count_once(db)
+
+
+@pytest.mark.postgres
+def test_fetch_rows(pgdb, pgpooldb):
+    from .test_db import fetch_rows
+
+    for db in (pgdb, pgpooldb):
+        fetch_rows(db)
+
+
+@pytest.mark.postgres
+def test_execute_many(pgdb, pgpooldb):
+    from .test_db import execute_many
+
+    for db in (pgdb, pgpooldb):
+        execute_many(db)
+
+
+@pytest.mark.postgres
+def test_gather(pgdb, pgpooldb):
+    from .test_db import gather
+
+    for db in (pgdb, pgpooldb):
+        gather(db)
+
+
+@pytest.mark.postgres
+def test_compact_rows(pyformat_sqldirs):
+    from .test_db import compact_rows
+
+    for uri in (util.PGSQL_URI, util.PGSQL_POOL_URI):
+        db = Database(uri, pyformat_sqldirs, compact_rows=True)
+        compact_rows(db)
+        with db.cursor as cursor:
+            user = cursor.user.by_name(name="User 1").one()
+            assert (user.count, user.count2) == (13, 13)
+            assert user._count("City A") == 1
+
+
+@pytest.mark.postgres
+def test_stream(pgdb, pgpooldb):
+    from .test_db import stream
+
+    for db in (pgdb, pgpooldb):
+        stream(db)
+
+
+@pytest.mark.postgres
+def test_stream_cursor(pgdb, pgpooldb):
+    from .test_db import stream_batches
+
+    for db in (pgdb, pgpooldb):
+        stream_batches(db)
+        with db.cursor as cur:
+            stream = cur.stream_cursor(3)
+            assert stream.cursor.name.startswith("quma_stream_")
+            assert stream.cursor.itersize == 3
+            # Open server side cursors are closed when the cursor is put
+            assert cur._streams == [stream]
+            query = cur.users.all(stream=3)
+            assert [user.name for user in query][:2] == ["User 1", "User 2"]
+            many = cur.users.all(stream=True).many()
+            assert len(many.get(2)) == 2
+            assert many.cursor.raw_cursor.cursor.name.startswith(
+                "quma_stream_"
+            )
+        assert stream.raw_cursor.cursor.closed
+        assert many.cursor.raw_cursor.cursor.closed
+
+        with db(autocommit=True).cursor as cur:
+            assert sum(1 for _ in cur.users.all(stream=2)) == 7
+
+
+@pytest.mark.postgres
+def test_reset(pgpooldb):
+    from psycopg2.extensions import (
+        TRANSACTION_STATUS_IDLE,
+        TRANSACTION_STATUS_INTRANS,
+    )
+
+    pool = pgpooldb.conn
+    conn = pool.get(autocommit=True)
+    conn.cursor().execute("SELECT 1")
+    pool.put(conn)
+    assert conn.autocommit is True
+    assert pool.get(autocommit=True) is conn
+    pool.put(conn)
+    conn = pool.get()
+    assert conn.autocommit is False
+    conn.cursor().execute("SELECT 1")
+    assert conn.get_transaction_status() == TRANSACTION_STATUS_INTRANS
+    pool.put(conn)
+    assert conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+    pgpooldb.close()
+
+
+@pytest.mark.postgres
+def test_pessimistic_autocommit(pyformat_sqldirs):
+    from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+    db = Database(util.PGSQL_POOL_URI, pyformat_sqldirs, pessimistic=True)
+    pool = db.conn
+    conn = pool.get()
+    pool.put(conn)
+    # Only a transactional connection is idle. It is checked and then
+    # switched to autocommit mode.
+    assert pool.get(autocommit=True) is conn
+    assert conn.autocommit is True
+    assert conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+    assert (pool.checks, pool.mode_switches) == (1, 1)
+    pool.put(conn)
+    assert pool.get() is conn
+    assert conn.autocommit is False
+    pool.put(conn)
+    db.close()
+
+
 @pytest.mark.postgres
 def test_execute(pgdb, pgpooldb):
     from .test_db import execute
@@ -328,3 +452,137 @@ def test_echo_parameter(pgdb_echo, pgpooldb_echo):
                 "'user.1@example.com' AND 1 = 1;\n"
             ) == sql["sql"]
     sys.stdout = tmp
+
+
+@pytest.mark.postgres
+def test_translate_prepared_statement():
+    from ..provider.postgresql import prepared_statement
+
+    assert prepared_statement("SELECT * FROM t WHERE a = %s AND b = %s;") == (
+        "SELECT * FROM t WHERE a = $1 AND b = $2",
+        " (%s, %s)",
+    )
+    assert prepared_statement(
+        "-- c\nUPDATE t SET a = %(a)s WHERE b = %(b)s OR c = %(a)s"
+    ) == (
+        "-- c\nUPDATE t SET a = $1 WHERE b = $2 OR c = $1",
+        " (%(a)s, %(b)s)",
+    )
+    assert prepared_statement("SELECT '100%%' FROM t") == (
+        "SELECT '100%' FROM t",
+        "",
+    )
+    for content in (
+        "SELECT 1; SELECT 2",
+        "CREATE TABLE t (a int)",
+        "SELECT %s, %(a)s",
+        "SELECT $$a$$",
+    ):
+        assert prepared_statement(content) is None
+
+
+@pytest.mark.postgres
+def test_prepare(pyformat_sqldirs):
+    for uri in (util.PGSQL_URI, util.PGSQL_POOL_URI):
+        db = Database(
+            uri, pyformat_sqldirs, changeling=True, prepare=2, prepare_size=2
+        )
+        with db.cursor as cur:
+            for _ in range(3):
+                assert len(cur.users.all()) == 7
+                assert cur.users.by_name(name="User 1").one().city == "City A"
+            cur.execute("SELECT name FROM pg_prepared_statements")
+            assert len(cur.fetchall()) == 2
+            # The third statement evicts the least recently used one
+            for _ in range(2):
+                assert len(cur.users.by_city(city="City A")) == 2
+            cur.execute("SELECT statement FROM pg_prepared_statements")
+            statements = [row[0] for row in cur.fetchall()]
+            assert len(statements) == 2
+            assert not any("ORDER BY id" in s for s in statements)
+            # A statement PostgreSQL refuses to prepare doesn't abort
+            # the transaction
+            for _ in range(3):
+                assert cur.query("SELECT %s IS NULL", None).value()
+            cur.rollback()
+        if uri == util.PGSQL_POOL_URI:
+            # The prepared statements survive the checkout
+            with db.cursor as cur:
+                cur.execute("SELECT name FROM pg_prepared_statements")
+                assert len(cur.fetchall()) == 2
+            db.close()
+
+
+@pytest.mark.postgres
+def test_copy_reader():
+    import datetime
+
+    from ..provider.postgresql import CopyReader
+
+    rows = [
+        (1, "a\tb", None, True, b"\x01"),
+        {"x": datetime.date(2020, 1, 2), "y": "back\\slash\n"},
+    ] * 3
+    reader = CopyReader(rows, columns=["x", "y"])
+    data = ""
+    while True:
+        chunk = reader.read(7)
+        if not chunk:
+            break
+        assert len(chunk) <= 7
+        data += chunk
+    assert reader.count == 6
+    assert data == (
+        "1\ta\\tb\t\\N\tt\t\\\\x01\n2020-01-02\tback\\\\slash\\n\n" * 3
+    )
+
+
+@pytest.mark.postgres
+def test_encode_copy_value():
+    import datetime
+    import decimal
+    import uuid
+
+    from ..provider.postgresql import encode_copy_value
+
+    assert encode_copy_value([1, 2]) == '{"1","2"}'
+    assert encode_copy_value((1, None)) == '{"1",NULL}'
+    assert encode_copy_value([[1, 2], [3, 4]]) == '{{"1","2"},{"3","4"}}'
+    assert encode_copy_value(['a "b"', "c,d"]) == '{"a \\\\"b\\\\"","c,d"}'
+    assert encode_copy_value(["back\\slash\n"]) == ('{"back\\\\\\\\slash\\n"}')
+    assert encode_copy_value([]) == "{}"
+    assert encode_copy_value(datetime.timedelta(days=1, seconds=2)) == (
+        "1 days 2.000000 seconds"
+    )
+    assert encode_copy_value(decimal.Decimal("1.50")) == "1.50"
+    uid = uuid.uuid4()
+    assert encode_copy_value(uid) == str(uid)
+    with pytest.raises(TypeError):
+        encode_copy_value({"a": 1})
+    with pytest.raises(TypeError):
+        encode_copy_value(object())
+
+
+@pytest.mark.postgres
+def test_copy(pgdb, pgpooldb):
+    for db in (pgdb, pgpooldb):
+        rows = (
+            (100 + i, "Copy {}".format(i), "copy@example.com", "Copy\tCity")
+            for i in range(1000)
+        )
+        assert db.copy("users", rows) == 1000
+        with db.cursor as cur:
+            assert cur.users.by_city(city="Copy\tCity").count() == 1000
+            assert (
+                cur.copy(
+                    "public.users",
+                    [{"id": 2000, "name": "Dict", "email": "d", "city": "D"}],
+                )
+                == 1
+            )
+            assert cur.copy("users", [], columns=["id"]) == 0
+            assert cur.users.by_city(city="D").one().name == "Dict"
+            cur.rollback()
+        with db.cursor as cur:
+            cur.query("DELETE FROM users WHERE id >= 100").run()
+            cur.commit()
@@ -0,0 +1,219 @@
+"""Watch the sqldirs of a :class:`quma.Database` for changes.
+
+Used if the database is initialized with ``cache=True`` and ``watch``
+to reload changed scripts and namespaces without a restart.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+
+log = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT = struct.Struct("iIII")
+
+
+def get_libc():
+    try:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+
+class Watcher(object):
+    """Abstract base class of sqldir watchers.
+
+    Runs in a daemon thread and calls ``db.reload(path)`` for every
+    created, modified or deleted script file or namespace directory.
+    """
+
+    def __init__(self, db, interval=1.0):
+        self.db = db
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def dirs(self):
+        """Return the sqldirs and their namespace directories."""
+        for root in list(self.db._roots):
+            yield root
+            for path in root.iterdir():
+                if path.is_dir() and path.name != "__pycache__":
+                    yield path
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.run, name="quma-watcher", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def dispatch(self, paths):
+        for path in dict.fromkeys(paths):
+            try:
+                self.db.reload(path)
+            except Exception:
+                log.exception("Failed to reload %s", path)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                paths = self.poll()
+            except Exception:
+                # E. g. a directory removed while it is scanned. Keep
+                # watching, the next poll sees the new state.
+                log.exception("Failed to poll the sqldirs for changes")
+                self._stopped.wait(self.interval)
+                continue
+            self.dispatch(paths)
+            self.wait()
+
+    def wait(self):
+        pass
+
+    def poll(self):
+        """Return the paths which have changed since the last call."""
+        raise NotImplementedError
+
+
+class PollingWatcher(Watcher):
+    """Compares the modification times and sizes of all files every
+    ``interval`` seconds."""
+
+    def __init__(self, db, interval=1.0):
+        super().__init__(db, interval)
+        self._snapshot = self.snapshot()
+
+    def snapshot(self):
+        snapshot = {}
+        for path in self.dirs():
+            snapshot[path] = None
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        st = entry.stat()
+                        snapshot[path / entry.name] = (
+                            st.st_mtime_ns,
+                            st.st_size,
+                        )
+        return snapshot
+
+    def poll(self):
+        old, new = self._snapshot, self.snapshot()
+        self._snapshot = new
+        changed = [
+            path
+            for path in new.keys() | old.keys()
+            if new.get(path, False) != old.get(path, False)
+        ]
+        # Directories (stored as None) come first as a reloaded
+        # namespace reads all of its files anyway.
+        return sorted(
+            changed,
+            key=lambda path: (new.get(path, old.get(path)) is not None, path),
+        )
+
+    def wait(self):
+        self._stopped.wait(self.interval)
+
+
+class InotifyWatcher(Watcher):
+    """Uses the inotify API of the Linux kernel. Waits at most
+    ``interval`` seconds for events before checking if it was stopped.
+    """
+
+    def __init__(self, db, interval=1.0, libc=None):
+        super().__init__(db, interval)
+        self.libc = libc or get_libc()
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}
+        for path in self.dirs():
+            self.add_watch(path)
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(str(path)), IN_MASK
+        )
+        if wd >= 0:
+            self._watches[wd] = path
+
+    def stop(self):
+        super().stop()
+        os.close(self.fd)
+
+    def poll(self):
+        ready, _, _ = select.select([self.fd], [], [], self.interval)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            path = directory / name
+            if mask & IN_ISDIR:
+                if directory not in self.db._roots:
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_watch(path)
+            elif mask & IN_CREATE:
+                # Wait for IN_CLOSE_WRITE
+                continue
+            paths.append(path)
+        return paths
+
+
+def watch(db, interval=1.0, method=None):
+    """Start and return a watcher for the sqldirs of ``db``.
+
+    :param method: ``'inotify'`` or ``'poll'``. If not given use
+        inotify if available and polling otherwise.
+    """
+    if method not in (None, "inotify", "poll"):
+        raise ValueError('Watch method must be "inotify" or "poll"')
+    if method != "poll":
+        libc = get_libc()
+        if libc is not None:
+            return InotifyWatcher(db, interval, libc=libc).start()
+        if method == "inotify":
+            raise OSError("inotify is not available on this system")
+    return PollingWatcher(db, interval).start()